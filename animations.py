@@ -0,0 +1,39 @@
+# アニメーション用の処理
+# シミュレーションは NumPy で一括して計算し、フレームには前のフレームからの差分だけを載せる
+import numpy as np
+
+
+def brownian_paths(n_points, n_steps, delta_t=0.1, seed=None):
+    # 全ステップの増分を一度に生成して累積和をとる（x, y とも形は (n_points, n_steps)、0ステップ目は原点）
+    rng = np.random.default_rng(seed)
+    increments = np.sqrt(delta_t) * rng.standard_normal((2, n_points, n_steps - 1))
+    paths = np.zeros((2, n_points, n_steps))
+    np.cumsum(increments, axis=2, out=paths[:, :, 1:])
+    return paths[0], paths[1]
+
+
+def keyframes(n_steps, max_frames):
+    # 0 から n_steps-1 までのステップ番号を最大 max_frames 個に間引く（最初と最後は必ず含む）
+    return np.unique(np.linspace(0, n_steps - 1, min(max_frames, n_steps)).round().astype(int))
+
+
+def segment_coordinates(x, y, start, stop):
+    # 全粒子の start..stop ステップの軌跡を、NaN で区切った1本の配列にまとめる
+    n_points = x.shape[0]
+    seg_x = np.full((n_points, stop - start + 2), np.nan)
+    seg_y = np.full((n_points, stop - start + 2), np.nan)
+    seg_x[:, :-1] = x[:, start:stop + 1]
+    seg_y[:, :-1] = y[:, start:stop + 1]
+    return seg_x.ravel(), seg_y.ravel()
+
+
+def histogram_frames(data, bin_edges, n_frames):
+    # 全サンプルを一度にビンへ割り当て、キーフレームごとの累積度数を (フレーム数, ビン数) の配列で返す
+    # 各サンプルを「それを初めて含むフレーム」に振り分けて1回の bincount で数え、累積和をとる
+    num_bins = len(bin_edges) - 1
+    steps = keyframes(len(data), n_frames)
+    bins = np.digitize(data, bin_edges) - 1
+    frame = np.searchsorted(steps, np.arange(len(data)))
+    inside = (bins >= 0) & (bins < num_bins)  # 範囲外のサンプルは数えない
+    counts = np.bincount(frame[inside] * num_bins + bins[inside], minlength=len(steps) * num_bins)
+    return steps, np.cumsum(counts.reshape(len(steps), num_bins), axis=0)
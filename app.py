@@ -4,457 +4,786 @@ import plotly.graph_objects as go
 import plotly.express as px
 import streamlit as st
 import numpy as np
-from pytrends.request import TrendReq
+from pathlib import Path
 
 st.set_page_config(layout="wide")
 
+# グラフはウィジェットの値ごとにキャッシュして再利用する（件数を超えたら古いものから破棄）
+FIGURE_CACHE_SIZE = 64
+figure_cache = st.cache_resource(max_entries=FIGURE_CACHE_SIZE, show_spinner=False)
+
 # PDFからのテーブル取得と可視化：都道府県別コロナ定点観測の折れ線
-import fitz
-import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin
-
-# 対象ページのURL
-url = "https://www.mhlw.go.jp/stf/seisakunitsuite/bunya/0000121431_00461.html"
-response = requests.get(url)
-response.raise_for_status()  # エラーが発生した場合、例外を投げる
-
-# BeautifulSoupでHTMLを解析
-soup = BeautifulSoup(response.text, "html.parser")
-
-# すべてのリンクを検索
-links = soup.find_all("a")
-
-# PDFファイルのURLを抽出
-pdf_urls = [link.get("href") for link in links if link.get("href") and ".pdf" in link.get("href")]
-
-# 相対URLを絶対URLに変換
-absolute_pdf_urls = [urljoin(url, pdf_url) for pdf_url in pdf_urls]
-
-# 最新のPDFのURLを取得
-latest_pdf_url = absolute_pdf_urls[0] if absolute_pdf_urls else None
-#latest_pdf_url = pdf_urls[0] if pdf_urls else None
-st.write(f"最新のPDFのURL: {latest_pdf_url}")
-
-# 取得したPDFアドレスからテーブル取得
-#url = 'https://www.mhlw.go.jp/content/001282915.pdf'
-url = latest_pdf_url
-response = requests.get(url)
-response.raise_for_status() # エラーになった時用
-
-# ローカルにPDFファイルを保存
-with open('covid.pdf', 'wb') as f:
-    f.write(response.content) 
-
-doc = fitz.open('covid.pdf', filetype="pdf")  
-page_1 = doc[2]
-pdf_text_1 = page_1.get_text("text")
-tabs = page_1.find_tables()
-
-table_data = tabs[0].extract()
-columns0 = table_data[0] 
-columns = table_data[1]
-columns[0] = "都道府県" 
-data_rows = table_data[2:]
-df = pd.DataFrame(data_rows, columns=columns)
-#st.table(df)
-st.subheader('PDFからのデータフレーム')
-st.write(df)
-
-prefectures = df["都道府県"].unique().tolist()
-selected_prefecture = st.selectbox("都道府県を選択してください:", prefectures, index=prefectures.index("京 都 府"))
-prefecture_data = df[df["都道府県"] == selected_prefecture]
-prefecture_data = prefecture_data.melt(id_vars=["都道府県"], var_name="週", value_name="値").drop(columns="都道府県")
-
-fig29 = px.line(prefecture_data, x="週", y="値", title=f"{selected_prefecture}の週ごとのデータ")
-st.subheader('2024年コロナ都道府県別定点観測:  ' + selected_prefecture)
-st.plotly_chart(fig29)
+from datasource import fetch, DEFAULT_TTL, load_json, read_csv, read_csv_cached
+from covid import MHLW_URL, backfill, by_prefecture, list_pdf_urls, load_table, to_long
+from graphs import METRICS, adjacency, edge_coordinates, random_geometric_graph
+from rendering import use_webgl, webgl
+from geo import load_index, publish_geojson, select_features, simplify_geojson, tolerance_for_zoom
+from downsample import downsample_frame
+from stats import box_stats, correlations, histograms
+from calendar_grid import calendar_grids
+from density import grouped_kde, violin_outline
+from trends import get_interest, is_refreshing
+from animations import brownian_paths, histogram_frames, keyframes, segment_coordinates
 
 
-# network graph
-import networkx as nx
-G = nx.random_geometric_graph(200, 0.125)
-edge_x = []
-edge_y = []
-for edge in G.edges():
-    x0, y0 = G.nodes[edge[0]]['pos']
-    x1, y1 = G.nodes[edge[1]]['pos']
-    edge_x.append(x0)
-    edge_x.append(x1)
-    edge_x.append(None)
-    edge_y.append(y0)
-    edge_y.append(y1)
-    edge_y.append(None)
-
-edge_trace = go.Scatter(
-    x=edge_x, y=edge_y,
-    line=dict(width=0.5, color='#888'),
-    hoverinfo='none',
-    mode='lines')
-
-node_x = []
-node_y = []
-for node in G.nodes():
-    x, y = G.nodes[node]['pos']
-    node_x.append(x)
-    node_y.append(y)
-
-node_trace = go.Scatter(
-    x=node_x, y=node_y,
-    mode='markers',
-    hoverinfo='text',
-    marker=dict(
-        showscale=True,
-        # colorscale options
-        #'Greys' | 'YlGnBu' | 'Greens' | 'YlOrRd' | 'Bluered' | 'RdBu' |
-        #'Reds' | 'Blues' | 'Picnic' | 'Rainbow' | 'Portland' | 'Jet' |
-        #'Hot' | 'Blackbody' | 'Earth' | 'Electric' | 'Viridis' |
-        colorscale='YlGnBu',
-        reversescale=True,
-        color=[],
-        size=10,
-        colorbar=dict(
-            thickness=15,
-            title='Node Connections',
-            xanchor='left',
-            titleside='right'
-        ),
-        line_width=2))
-
-node_adjacencies = []
-node_text = []
-for node, adjacencies in enumerate(G.adjacency()):
-    node_adjacencies.append(len(adjacencies[1]))
-    node_text.append('# of connections: '+str(len(adjacencies[1])))
-
-node_trace.marker.color = node_adjacencies
-node_trace.text = node_text
-
-fig28 = go.Figure(data=[edge_trace, node_trace],
-             layout=go.Layout(
-                title='<br>Network graph made with Python',
-                titlefont_size=16,
-                showlegend=False,
-                hovermode='closest',
-                margin=dict(b=20,l=5,r=5,t=40),
-                annotations=[ dict(
-                    text="Python code: <a href='https://plotly.com/python/network-graphs/'> https://plotly.com/python/network-graphs/</a>",
-                    showarrow=False,
-                    xref="paper", yref="paper",
-                    x=0.005, y=-0.002 ) ],
-                xaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
-                yaxis=dict(showgrid=False, zeroline=False, showticklabels=False))
-                )
-st.subheader('network graph')
-st.plotly_chart(fig28)
-
-# contour plot
-fig27 = go.Figure(data=go.Contour(
-            z=[[10, 10.625, 12.5, 15.625, 20],
-            [5.625, 6.25, 8.125, 11.25, 15.625],
-            [2.5, 3.125, 5., 8.125, 12.5],
-            [0.625, 1.25, 3.125, 6.25, 10.625],
-            [0, 0.625, 2.5, 5.625, 10]]
-            ))
-st.subheader('contour plot')
-st.plotly_chart(fig27)
-
-# ridgeline plot
-from plotly.colors import n_colors
-# 12 sets of normal distributed random data, with increasing mean and standard deviation
-np.random.seed(1)
-data = (np.linspace(1, 2, 12)[:, np.newaxis] * np.random.randn(12, 200) +
-            (np.arange(12) + 2 * np.random.random(12))[:, np.newaxis])
-colors = n_colors('rgb(5, 200, 200)', 'rgb(200, 10, 10)', 12, colortype='rgb')
-
-fig26 = go.Figure()
-for data_line, color in zip(data, colors):
-    fig26.add_trace(go.Violin(x=data_line, line_color=color))
-
-fig26.update_traces(orientation='h', side='positive', width=3, points=False)
-fig26.update_layout(xaxis_showgrid=False, xaxis_zeroline=False)
-st.subheader('ridgeline plot')
-st.plotly_chart(fig26)
-
-
-# violin plot
-df = px.data.tips()
-fig23 = px.violin(df, y="total_bill")
-fig24 = px.violin(df, y="total_bill", box=True, # draw box plot inside the violin
-                points='all', # can be 'outliers', or False
-               )
-
-st.subheader('violin plot')
-st.plotly_chart(fig23)
-st.plotly_chart(fig24)
-
-# another violin plot
-df = pd.read_csv("https://raw.githubusercontent.com/plotly/datasets/master/violin_data.csv")
-pointpos_male = [-0.9,-1.1,-0.6,-0.3]
-pointpos_female = [0.45,0.55,1,0.4]
-show_legend = [True,False,False,False]
-
-fig25 = go.Figure()
-for i in range(0,len(pd.unique(df['day']))):
-    fig25.add_trace(go.Violin(x=df['day'][(df['sex'] == 'Male') &
-                                        (df['day'] == pd.unique(df['day'])[i])],
-                            y=df['total_bill'][(df['sex'] == 'Male')&
-                                               (df['day'] == pd.unique(df['day'])[i])],
-                            legendgroup='M', scalegroup='M', name='M',
-                            side='negative',
-                            pointpos=pointpos_male[i], # where to position points
-                            line_color='lightseagreen',
-                            showlegend=show_legend[i])
-             )
-    fig25.add_trace(go.Violin(x=df['day'][(df['sex'] == 'Female') &
-                                        (df['day'] == pd.unique(df['day'])[i])],
-                            y=df['total_bill'][(df['sex'] == 'Female')&
-                                               (df['day'] == pd.unique(df['day'])[i])],
-                            legendgroup='F', scalegroup='F', name='F',
-                            side='positive',
-                            pointpos=pointpos_female[i],
-                            line_color='mediumpurple',
-                            showlegend=show_legend[i])
-             )
-
-# update characteristics shared by all traces
-fig25.update_traces(meanline_visible=True,
-                  points='all', # show all points
-                  jitter=0.05,  # add some jitter on points for better visibility
-                  scalemode='count') #scale violin plot area with total count
-fig25.update_layout(
-    title_text="Total bill distribution<br><i>scaled by number of bills per gender",
-    violingap=0, violingroupgap=0, violinmode='overlay')
-
-st.subheader('Another violin plot')
-st.plotly_chart(fig25)
-
-# funnel plot
-fig22 = go.Figure(go.Funnel(
-    y = ["Website visit", "Downloads", "Potential customers", "Requested price", "invoice sent"],
-    x = [39, 27.4, 20.6, 11, 2]))
-
-st.subheader('funnel plot')
-st.plotly_chart(fig22)
-
-# histogram animation
-import time
-bins = [0, 1, 2, 3]
-hist_values = [5, 8, 4]
-max_height = max(hist_values)
-
-# Streamlitのセットアップ
-st.subheader("Falling Blocks Histogram")
-start_button = st.button("Start Animation")
-
-# 初期のプロットの設定
-fig = go.Figure()
-fig.update_xaxes(range=[0, 3], tickvals=[0.5, 1.5, 2.5], ticktext=["0-1", "1-2", "2-3"])
-fig.update_yaxes(range=[0, max_height])
-
-# 初期のブロックの表示
-for i in range(len(bins) - 1):
-    fig.add_trace(go.Scatter(
-        x=[bins[i] + 0.5] * hist_values[i],
-        y=[0] * hist_values[i],
-        mode='markers',
-        marker=dict(size=20, color='blue')
-    ))
+def plotly_chart(fig, container=st, **kwargs):
+    # 点の多い図はWebGLのトレースに切り替えてから表示する
+    return container.plotly_chart(webgl(fig), **kwargs)
+
+
+# 時系列の折れ線は画面の幅程度の点数に間引いてから送る
+DOWNSAMPLE_POINTS = 1000
+
+
+def _x_range_key(key):
+    return f"{key}_x_range"
+
+
+def selected_x_range(key):
+    # 図の上でドラッグして選んだ範囲（なければ None）
+    # 図のウィジェットのIDは図の内容からも作られ、描き直すと選択が消えるので、範囲は別のキーに保存しておく
+    return st.session_state.get(_x_range_key(key))
 
-plot = st.plotly_chart(fig)
 
-# ボタンが押されたか確認
-if start_button:
-    # ブロックを上から落とすアニメーション
-    for step in range(max_height):
-        new_fig = go.Figure()
-        for i in range(len(bins) - 1):
-            y_vals = [j for j in range(hist_values[i]) if j <= step]
-            new_fig.add_trace(go.Scatter(
-                x=[bins[i] + 0.5] * len(y_vals),
-                y=y_vals,
-                mode='markers',
-                marker=dict(size=20, color='blue')
-            ))
-        new_fig.update_xaxes(range=[0, 3], tickvals=[0.5, 1.5, 2.5], ticktext=["0-1", "1-2", "2-3"])
-        new_fig.update_yaxes(range=[0, max_height])
-        plot.plotly_chart(new_fig)
-        time.sleep(0.5)    
-    st.write("Histogram completed!")
-
-
-# histogram animation (from bottom)
-data = np.random.normal(loc=0, scale=1, size=100)
-num_bins = 10
-bin_counts = np.zeros(num_bins)
-
-# ヒストグラムの範囲を設定
-bin_edges = np.linspace(-4, 4, num_bins + 1)
-x = (bin_edges[:-1] + bin_edges[1:]) / 2
-
-# 初期設定
-frames = []
-for i in range(len(data)):
-    new_value = data[i]
-    bin_index = np.digitize(new_value, bin_edges) - 1
-    bin_counts[bin_index] += 1
-    
-    frame = go.Frame(
-        data=[go.Bar(x=x, y=bin_counts, width=0.7, marker_color='blue')],
-        name=str(i)
-    )
-    frames.append(frame)
+def _store_x_range(key):
+    state = st.session_state.get(key)
+    box = state["selection"]["box"] if state else []
+    if box:
+        st.session_state[_x_range_key(key)] = tuple(sorted(box[0]["x"]))
 
-# 初期フレーム
-initial_frame = frames[0]
 
-# プロットの設定
-fig = go.Figure(
-    data=initial_frame.data,
-    layout=go.Layout(
-        xaxis=dict(range=[-4, 4]),
-        yaxis=dict(range=[0, max(bin_counts) + 1]),
-        updatemenus=[dict(
-            type="buttons",
-            showactive=False,
-            buttons=[dict(label="Play",
-                          method="animate",
-                          args=[None, dict(frame=dict(duration=100, redraw=True), fromcurrent=True)])]
-        )]
-    ),
-    frames=frames
-)
+def _clear_x_range(key):
+    st.session_state.pop(_x_range_key(key), None)
 
-st.subheader("テトリス風ヒストグラムアニメーション")
-st.plotly_chart(fig)
 
+def timeseries_chart(fig, key, container=st):
+    # 範囲を選択すると再実行され、その範囲だけを間引き直して細かく描く。ボタンで全体の表示に戻す
+    # キャッシュした図は他のセッションと共有しているので、コピーに設定する
+    fig = go.Figure(fig).update_layout(dragmode="select", selectdirection="h")
+    element = plotly_chart(fig, container, key=key, on_select=lambda: _store_x_range(key), selection_mode="box")
+    if selected_x_range(key) is not None:
+        container.button('全体を表示', key=f"{key}_reset", on_click=_clear_x_range, args=(key,))
+    return element
 
 
+# 一覧ページはTTLごとに条件付きGETで再検証し、変化がなければ再ダウンロードしない
+@st.cache_data(ttl=DEFAULT_TTL, show_spinner=False)
+def get_pdf_urls(url):
+    return list_pdf_urls(url)
 
-# 2D Brownian motion
-n_points = 3
-n_steps = 100
-delta_t = 0.1
+# PDFのURLは公開後に内容が変わらないので無期限にキャッシュする
+@st.cache_data(show_spinner=False)
+def get_pdf(url):
+    return fetch(url, ttl=None)
 
-np.random.seed(42)  # For reproducibility
-x = np.zeros((n_points, n_steps))
-y = np.zeros((n_points, n_steps))
+# PDFはメモリ上で解析し、抽出したテーブルはPDFのハッシュごとにキャッシュする
+@st.cache_data(show_spinner=False)
+def get_covid_table(_pdf_bytes, pdf_sha256):
+    return load_table(_pdf_bytes, pdf_sha256)
 
-for i in range(1, n_steps):
-    x[:, i] = x[:, i-1] + np.sqrt(delta_t) * np.random.randn(n_points)
-    y[:, i] = y[:, i-1] + np.sqrt(delta_t) * np.random.randn(n_points)
+# 数値の縦持ちに一度だけ変換し、都道府県をインデックスにしてキャッシュする
+@st.cache_data(show_spinner=False)
+def get_covid_long(_df, pdf_sha256):
+    return by_prefecture(to_long(_df))
 
-colors = [f'rgba({r}, {g}, {b}, 0.8)' for r, g, b in np.random.randint(0, 255, size=(n_points, 3))]
+@figure_cache
+def build_covid_line(pdf_sha256, selected_prefecture, _covid_long):
+    prefecture_data = _covid_long.loc[[selected_prefecture]]
+    return px.line(prefecture_data, x="週", y="値", title=f"{selected_prefecture}の週ごとのデータ")
 
-fig0 = go.Figure()
-for i in range(n_points):
-    fig0.add_trace(go.Scatter(
-        x=[x[i, 0]],
-        y=[y[i, 0]],
-        mode='lines',
-        line=dict(color=colors[i], width=1),
-        showlegend=False
-    ))
+# 過去のPDFをすべて取り込んだ時系列（バックフィル）
+@st.cache_data(ttl=DEFAULT_TTL, show_spinner="過去のPDFを取り込んでいます...")
+def get_covid_series(pdf_urls):
+    return by_prefecture(backfill(pdf_urls))
 
-fig0.update_layout(
-    xaxis=dict(range=[-10, 10], autorange=False),
-    yaxis=dict(range=[-10, 10], autorange=False),
-    title="2D Brownian Motion",
-    updatemenus=[dict(
-        type="buttons",
-        buttons=[dict(label="Play",
-                      method="animate",
-                      args=[None, {"frame": {"duration": 50, "redraw": True}, "fromcurrent": True, "mode": "immediate"}])]
-    )]
-)
-fig0.frames = [go.Frame(data=[go.Scatter(x=x[i, :k+1], y=y[i, :k+1]) for i in range(n_points)]) for k in range(n_steps)]
-
-fig00 = go.Figure()
-for i in range(n_points):
-    fig00.add_trace(go.Scatter(
-        x=[x[i, 0]],
-        y=[y[i, 0]],
+
+# 都道府県別コロナ定点観測
+def covid_section():
+    absolute_pdf_urls = get_pdf_urls(MHLW_URL)
+
+    # 最新のPDFのURLを取得
+    latest_pdf_url = absolute_pdf_urls[0] if absolute_pdf_urls else None
+    #latest_pdf_url = pdf_urls[0] if pdf_urls else None
+    st.write(f"最新のPDFのURL: {latest_pdf_url}")
+
+    # 取得したPDFアドレスからテーブル取得
+    #url = 'https://www.mhlw.go.jp/content/001282915.pdf'
+    pdf = get_pdf(latest_pdf_url)
+    df = get_covid_table(pdf.content, pdf.sha256)
+
+    #st.table(df)
+    st.subheader('PDFからのデータフレーム')
+    st.write(df)
+
+    covid_long = get_covid_long(df, pdf.sha256)
+    prefectures = covid_long.index.unique().tolist()
+    selected_prefecture = st.selectbox("都道府県を選択してください:", prefectures,
+                                       index=prefectures.index("京都府") if "京都府" in prefectures else 0)
+    fig29 = build_covid_line(pdf.sha256, selected_prefecture, covid_long)
+    st.subheader('2024年コロナ都道府県別定点観測:  ' + selected_prefecture)
+    plotly_chart(fig29)
+
+    # 全都道府県を並べて表示（フィルタやmeltを都道府県ごとに繰り返さない）
+    if st.checkbox("全都道府県を並べて表示"):
+        fig29_all = px.line(covid_long.reset_index(), x="週", y="値", facet_col="都道府県", facet_col_wrap=8,
+                            facet_row_spacing=0.02, height=1200)
+        fig29_all.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
+        fig29_all.update_xaxes(showticklabels=False, title=None)
+        fig29_all.update_yaxes(title=None)
+        plotly_chart(fig29_all)
+
+    if st.checkbox("過去のPDFもすべて取り込む（バックフィル）"):
+        series = get_covid_series(tuple(absolute_pdf_urls))
+        prefecture_series = series.loc[selected_prefecture:selected_prefecture]
+        fig30 = px.line(prefecture_series, x="週", y="値", title=f"{selected_prefecture}の週ごとのデータ（全期間）")
+        st.subheader('コロナ都道府県別定点観測（全期間）:  ' + selected_prefecture)
+        plotly_chart(fig30)
+
+
+# network graph
+# ノード数が多いときはマーカーを小さくして重なりを減らす
+NETWORK_SMALL_MARKER_NODES = 5000
+
+
+# ノードの色に使う指標（疎行列で計算し、グラフごとにキャッシュする）
+NETWORK_METRICS = {
+    "次数": "degree",
+    "クラスタ係数": "clustering",
+    "PageRank": "pagerank",
+    "媒介中心性（近似）": "betweenness",
+}
+
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def get_network(n_nodes, radius):
+    pos, edges = random_geometric_graph(n_nodes, radius)
+    return pos, edges, adjacency(n_nodes, edges)
+
+
+@st.cache_resource(max_entries=32, show_spinner="指標を計算しています...")
+def get_node_metric(n_nodes, radius, metric):
+    pos, edges, A = get_network(n_nodes, radius)
+    return METRICS[metric](A)
+
+
+@figure_cache
+def build_network_figure(n_nodes, radius, metric_label):
+    pos, edges, A = get_network(n_nodes, radius)
+    edge_x, edge_y = edge_coordinates(pos, edges)
+    node_colors = get_node_metric(n_nodes, radius, NETWORK_METRICS[metric_label])
+    large = n_nodes > NETWORK_SMALL_MARKER_NODES
+    # 点の数が多いと分かっているので、あとで変換せずに最初からWebGLのトレースで作る
+    Scatter = go.Scattergl if use_webgl(len(edge_x) + n_nodes) else go.Scatter
+
+    edge_trace = Scatter(
+        x=edge_x, y=edge_y,
+        line=dict(width=0.5, color='#888'),
+        hoverinfo='none',
+        mode='lines')
+
+    node_trace = Scatter(
+        x=pos[:, 0], y=pos[:, 1],
         mode='markers',
-        marker=dict(color=colors[i], size=5),
-        showlegend=False
-    ))
+        hovertemplate=metric_label + ': %{marker.color:.4g}<extra></extra>',
+        marker=dict(
+            showscale=True,
+            # colorscale options
+            #'Greys' | 'YlGnBu' | 'Greens' | 'YlOrRd' | 'Bluered' | 'RdBu' |
+            #'Reds' | 'Blues' | 'Picnic' | 'Rainbow' | 'Portland' | 'Jet' |
+            #'Hot' | 'Blackbody' | 'Earth' | 'Electric' | 'Viridis' |
+            colorscale='YlGnBu',
+            reversescale=True,
+            color=node_colors,
+            size=3 if large else 10,
+            colorbar=dict(
+                thickness=15,
+                title='Node Connections' if metric_label == "次数" else metric_label,
+                xanchor='left',
+                titleside='right'
+            ),
+            line_width=0 if large else 2))
+
+    fig28 = go.Figure(data=[edge_trace, node_trace],
+                 layout=go.Layout(
+                    title='<br>Network graph made with Python',
+                    titlefont_size=16,
+                    showlegend=False,
+                    hovermode='closest',
+                    margin=dict(b=20,l=5,r=5,t=40),
+                    annotations=[ dict(
+                        text="Python code: <a href='https://plotly.com/python/network-graphs/'> https://plotly.com/python/network-graphs/</a>",
+                        showarrow=False,
+                        xref="paper", yref="paper",
+                        x=0.005, y=-0.002 ) ],
+                    xaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
+                    yaxis=dict(showgrid=False, zeroline=False, showticklabels=False))
+                    )
+    return fig28
+
+
+def network_section():
+    n_nodes = st.select_slider('ノード数', options=[200, 1000, 10000, 100000], value=200)
+    metric_label = st.radio('ノードの色', list(NETWORK_METRICS), horizontal=True)
+    # ノード数を変えても平均次数がほぼ同じになるように半径を調整する
+    radius = 0.125 * np.sqrt(200 / n_nodes)
+    fig28 = build_network_figure(n_nodes, radius, metric_label)
+    st.subheader('network graph')
+    plotly_chart(fig28)
+
+
+# 分布の可視化
+# 分布
+# 密度（KDE）はサーバー側でグループごとに計算し、曲線を塗りつぶした折れ線として描く（生のサンプルは送らない）
+# 点を重ねて描くのは件数がこれ以下のグループだけにする
+VIOLIN_MAX_POINTS = 2000
+
+
+def density_trace(stats, position, scale, side, color, fillcolor, name, horizontal=False, **kwargs):
+    values, positions = violin_outline(stats["grid"], stats["density"], position, scale, side)
+    x, y = (values, positions) if horizontal else (positions, values)
+    return go.Scatter(x=x, y=y, mode='lines', fill='toself', line=dict(color=color, width=1),
+                      fillcolor=fillcolor, name=name, hoveron='fills', **kwargs)
+
+
+def jittered(position, n, jitter, seed=0):
+    # 点の位置を横に少しずらして重なりを減らす
+    return position + np.random.default_rng(seed).uniform(-jitter, jitter, n)
+
+
+@figure_cache
+def build_ridgeline_figure():
+    # ridgeline plot
+    from plotly.colors import n_colors
+    # 12 sets of normal distributed random data, with increasing mean and standard deviation
+    np.random.seed(1)
+    data = (np.linspace(1, 2, 12)[:, np.newaxis] * np.random.randn(12, 200) +
+                (np.arange(12) + 2 * np.random.random(12))[:, np.newaxis])
+    colors = n_colors('rgb(5, 200, 200)', 'rgb(200, 10, 10)', 12, colortype='rgb')
+
+    long = pd.DataFrame({'trace': np.repeat(np.arange(12), data.shape[1]), 'value': data.ravel()})
+    densities = grouped_kde(long, 'value', 'trace')
+
+    # 各曲線の高さの最大を 1.5（go.Violin の width=3 の片側）にそろえる
+    fig26 = go.Figure()
+    for i, color in enumerate(colors):
+        stats = densities[i]
+        fig26.add_trace(density_trace(stats, i, 1.5 / stats["density"].max(), 'positive', color,
+                                      color.replace('rgb', 'rgba').replace(')', ', 0.5)'), f'trace {i}',
+                                      horizontal=True))
+    fig26.update_layout(xaxis_showgrid=False, xaxis_zeroline=False,
+                        yaxis=dict(tickvals=list(range(12)), ticktext=[f'trace {i}' for i in range(12)]))
+    return fig26
+
+
+@figure_cache
+def build_tips_violin_figures():
+    # violin plot
+    df = px.data.tips()
+    stats = grouped_kde(df.assign(all=''), 'total_bill', 'all', max_samples=VIOLIN_MAX_POINTS)['']
+    summary, _ = box_stats(df[['total_bill']])
+    row = summary.loc['total_bill']
+    # go.Violin の既定の幅（violingap=0.3）に合わせて片側の幅の最大を 0.35 にする
+    scale = 0.35 / stats["density"].max()
+
+    figures = []
+    for box in (False, True):
+        fig = go.Figure(density_trace(stats, 0, scale, 'both', '#636efa', 'rgba(99, 110, 250, 0.5)', 'total_bill'))
+        if box: # draw box plot inside the violin
+            fig.add_trace(go.Box(x=[0], q1=[row['q1']], median=[row['median']], q3=[row['q3']],
+                                 lowerfence=[row['lowerfence']], upperfence=[row['upperfence']],
+                                 width=0.05, marker_color='#636efa', fillcolor='white', name='total_bill'))
+            if "samples" in stats:
+                values = stats["samples"]
+                fig.add_trace(go.Scatter(x=jittered(-0.55, len(values), 0.1), y=values, mode='markers',
+                                         marker=dict(color='#636efa', size=4), name='total_bill'))
+        fig.update_layout(xaxis=dict(showticklabels=False, zeroline=False), yaxis_title='total_bill',
+                          showlegend=False)
+        figures.append(fig)
+    return figures
+
+
+@figure_cache
+def build_split_violin_figure():
+    # another violin plot
+    df = read_csv("https://raw.githubusercontent.com/plotly/datasets/master/violin_data.csv")
+    days = list(pd.unique(df['day']))
+    densities = grouped_kde(df, 'total_bill', ['day', 'sex'], max_samples=VIOLIN_MAX_POINTS)
+    sides = {
+        'Male': dict(name='M', side='negative', color='lightseagreen', fillcolor='rgba(32, 178, 170, 0.5)',
+                     pointpos=[-0.9, -1.1, -0.6, -0.3]),
+        'Female': dict(name='F', side='positive', color='mediumpurple', fillcolor='rgba(147, 112, 219, 0.5)',
+                       pointpos=[0.45, 0.55, 1, 0.4]),
+    }
+
+    fig25 = go.Figure()
+    for sex, style in sides.items():
+        groups = {i: densities[(day, sex)] for i, day in enumerate(days) if (day, sex) in densities}
+        # scalemode='count' と同じく、面積が件数に比例するように性別ごとに共通の倍率で幅をとる（最大の片側の幅は 0.5）
+        scale = 0.5 / max(stats["density"].max() * stats["count"] for stats in groups.values())
+        sign = -1 if style['side'] == 'negative' else 1
+        for i, stats in groups.items():
+            width = scale * stats["count"]
+            fig25.add_trace(density_trace(stats, i, width, style['side'], style['color'], style['fillcolor'],
+                                          style['name'], legendgroup=style['name'], showlegend=i == 0))
+            # 平均の位置に、密度の幅いっぱいの線を引く（meanline）
+            half = np.interp(stats["mean"], stats["grid"], stats["density"]) * width
+            fig25.add_trace(go.Scatter(x=[i, i + sign * half], y=[stats["mean"]] * 2, mode='lines',
+                                       line=dict(color=style['color'], width=2), legendgroup=style['name'],
+                                       showlegend=False, hoverinfo='skip'))
+
+        # 点は性別ごとに1つのトレースにまとめる
+        point_x, point_y = [], []
+        for i, stats in groups.items():
+            if "samples" in stats:
+                point_x.append(jittered(i + style['pointpos'][i] * 0.5, stats["count"], 0.025, seed=i))
+                point_y.append(stats["samples"])
+        if point_x:
+            fig25.add_trace(go.Scatter(x=np.concatenate(point_x), y=np.concatenate(point_y), mode='markers',
+                                       marker=dict(color=style['color'], size=4), name=style['name'],
+                                       legendgroup=style['name'], showlegend=False))
+
+    fig25.update_layout(
+        title_text="Total bill distribution<br><i>scaled by number of bills per gender",
+        xaxis=dict(tickvals=list(range(len(days))), ticktext=days, zeroline=False))
+    return fig25
+
+
+def distribution_section():
+    st.subheader('ridgeline plot')
+    plotly_chart(build_ridgeline_figure())
+
+    fig23, fig24 = build_tips_violin_figures()
+    st.subheader('violin plot')
+    plotly_chart(fig23)
+    plotly_chart(fig24)
+
+    st.subheader('Another violin plot')
+    plotly_chart(build_split_violin_figure())
+
+
+# アニメーション
+# ヒストグラムのアニメーションのフレーム数の上限（サンプル数が多いときは間引く）
+HISTOGRAM_MAX_FRAMES = 100
+
+
+@figure_cache
+def build_histogram_animation(n_samples):
+    # histogram animation (from bottom)
+    data = np.random.normal(loc=0, scale=1, size=n_samples)
+    num_bins = 10
+
+    # ヒストグラムの範囲を設定
+    bin_edges = np.linspace(-4, 4, num_bins + 1)
+    x = (bin_edges[:-1] + bin_edges[1:]) / 2
+
+    # 全サンプルのビン分けと累積度数はまとめて計算し、フレームには各時点の棒の高さだけを載せる
+    steps, bin_counts = histogram_frames(data, bin_edges, HISTOGRAM_MAX_FRAMES)
+    frames = [go.Frame(data=[go.Bar(y=counts)], name=str(k)) for k, counts in zip(steps, bin_counts)]
+
+    # プロットの設定
+    fig = go.Figure(
+        data=[go.Bar(x=x, y=bin_counts[0], width=0.7, marker_color='blue')],
+        layout=go.Layout(
+            xaxis=dict(range=[-4, 4]),
+            yaxis=dict(range=[0, bin_counts[-1].max() * 1.05 + 1]),
+            updatemenus=[dict(
+                type="buttons",
+                showactive=False,
+                buttons=[dict(label="Play",
+                              method="animate",
+                              args=[None, dict(frame=dict(duration=100, redraw=True), fromcurrent=True)])]
+            )]
+        ),
+        frames=frames
+    )
+    return fig
 
-fig00.update_layout(
-    xaxis=dict(range=[-10, 10], autorange=False),
-    yaxis=dict(range=[-10, 10], autorange=False),
-    title="2D Brownian Motion",
-    updatemenus=[dict(
-        type="buttons",
-        buttons=[dict(label="Play",
-                      method="animate",
-                      args=[None, {"frame": {"duration": 50, "redraw": True}, "fromcurrent": True, "mode": "immediate"}])]
-    )]
-)
-fig00.frames = [go.Frame(data=[go.Scatter(x=[x[i, k]], y=[y[i, k]], mode='markers', marker=dict(color=colors[i], size=5)) for i in range(n_points)]) for k in range(n_steps)]
 
-left_column3, right_column3 = st.columns(2)
-left_column3.subheader('2D Brownian Motion Animation')
-left_column3.plotly_chart(fig0)
-right_column3.subheader('2D Brownian Motion Animation (w/o trace)')
-right_column3.plotly_chart(fig00)
+@st.fragment
+def histogram_animation_panel():
+    n_samples = st.select_slider('サンプル数', options=[100, 10_000, 1_000_000], value=100)
+    fig = build_histogram_animation(n_samples)
+    st.subheader("テトリス風ヒストグラムアニメーション")
+    plotly_chart(fig)
 
 
-# data
-df2 = pd.read_csv('data/koukouseiseki.csv')
-df3 = pd.read_csv('data/nikkei225.csv')
-vars2 = [var for var in df2.columns]
-vars3 = [var for var in df3.columns]
+# ブラウン運動のアニメーションのフレーム数の上限（ステップ数が多いときは間引く）
+BROWNIAN_MAX_FRAMES = 200
 
 
-# Layout (Sidebar)
-st.sidebar.markdown("## サイドバーの使い方")
-vars2_selected = st.sidebar.selectbox('散布図：高校科目', vars2)
-vars2_multi_selected = st.sidebar.multiselect('相関行列：高校科目', vars2, default=vars2) # デフォルトは全部
-vars3_selected = st.sidebar.selectbox('日経225の折れ線グラフ', vars3[1:])
-vars3_multi_selected = st.sidebar.multiselect('日経225の折れ線グラフ（複数）', vars3, default=vars3[1:])
+@figure_cache
+def build_brownian_figures(n_points, n_steps):
+    # 2D Brownian motion
+    delta_t = 0.1
+    x, y = brownian_paths(n_points, n_steps, delta_t, seed=42)  # For reproducibility
+    # 描画には小数3桁で十分なので丸めて、フレームのJSONを小さくする
+    x, y = x.round(3), y.round(3)
+    steps = keyframes(n_steps, BROWNIAN_MAX_FRAMES)
 
+    rng = np.random.default_rng(42)
+    colors = [f'rgba({r}, {g}, {b}, 0.8)' for r, g, b in rng.integers(0, 255, size=(n_points, 3))]
+    limit = max(10, np.ceil(max(np.abs(x).max(), np.abs(y).max())))
+    Scatter = go.Scattergl if use_webgl(x.size) else go.Scatter
 
-# map graph
-from urllib.request import urlopen
-import json
-with urlopen('https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json') as response:
-    counties = json.load(response)
+    layout = dict(
+        xaxis=dict(range=[-limit, limit], autorange=False),
+        yaxis=dict(range=[-limit, limit], autorange=False),
+        title="2D Brownian Motion",
+        showlegend=False,
+        updatemenus=[dict(
+            type="buttons",
+            buttons=[dict(label="Play",
+                          method="animate",
+                          args=[None, {"frame": {"duration": 50, "redraw": True}, "fromcurrent": True, "mode": "immediate"}])]
+        )]
+    )
 
-import pandas as pd
-df = pd.read_csv("https://raw.githubusercontent.com/plotly/datasets/master/fips-unemp-16.csv",
-                   dtype={"fips": str})
-import plotly.express as px
-fig11 = px.choropleth(df, geojson=counties, locations='fips', color='unemp',
-                           color_continuous_scale="Viridis",
-                           range_color=(0, 12),
-                           scope="usa",
-                           labels={'unemp':'unemployment rate'}
-                          )
-fig11.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+    def heads(k):
+        # フレームは既存のトレースに上書きされるので、座標だけを載せる（色などは最初のトレースのまま）
+        return Scatter(x=x[:, k], y=y[:, k])
+
+    head_style = dict(mode='markers', marker=dict(color=colors, size=5))
+
+    # 軌跡はキーフレーム間の区間ごとに1本のトレースにし、各フレームでは新しい区間のトレースだけを送る
+    # （前の区間はそのまま残るので、フレームの合計サイズはステップ数に比例する）
+    n_segments = len(steps) - 1
+    segment_style = dict(mode='lines', line=dict(color='rgba(120, 120, 120, 0.6)', width=1), hoverinfo='skip')
+    fig0 = go.Figure(data=[Scatter(x=[], y=[], **segment_style) for _ in range(n_segments)]
+                     + [Scatter(x=x[:, 0], y=y[:, 0], **head_style)], layout=layout)
+    # 最初のフレームで軌跡を消しておき、もう一度再生したときに前回の軌跡が残らないようにする
+    frames = [go.Frame(data=[Scatter(x=[], y=[]) for _ in range(n_segments)] + [heads(0)], name='0')]
+    for t in range(1, len(steps)):
+        seg_x, seg_y = segment_coordinates(x, y, steps[t - 1], steps[t])
+        frames.append(go.Frame(data=[Scatter(x=seg_x, y=seg_y), heads(steps[t])],
+                               traces=[t - 1, n_segments], name=str(steps[t])))
+    fig0.frames = frames
+
+    # 軌跡なしは全粒子を1本のトレースにまとめ、フレームごとに現在位置だけを送る
+    fig00 = go.Figure(data=[Scatter(x=x[:, 0], y=y[:, 0], **head_style)], layout=layout)
+    fig00.frames = [go.Frame(data=[heads(k)], name=str(k)) for k in steps]
+    return fig0, fig00
+
+
+@st.fragment
+def brownian_panel():
+    left, right = st.columns(2)
+    n_points = left.select_slider('粒子数', options=[3, 30, 300], value=3)
+    n_steps = right.select_slider('ステップ数', options=[100, 1000, 5000], value=100)
+    fig0, fig00 = build_brownian_figures(n_points, n_steps)
+
+    left_column3, right_column3 = st.columns(2)
+    left_column3.subheader('2D Brownian Motion Animation')
+    plotly_chart(fig0, left_column3)
+    right_column3.subheader('2D Brownian Motion Animation (w/o trace)')
+    plotly_chart(fig00, right_column3)
+
+
+@figure_cache
+def build_falling_blocks_figure():
+    # histogram animation
+    bins = [0, 1, 2, 3]
+    hist_values = [5, 8, 4]
+    max_height = max(hist_values)
+
+    # 初期のプロットの設定
+    fig = go.Figure()
+    fig.update_xaxes(range=[0, 3], tickvals=[0.5, 1.5, 2.5], ticktext=["0-1", "1-2", "2-3"])
+    fig.update_yaxes(range=[0, max_height])
+
+    # 初期のブロックの表示
+    for i in range(len(bins) - 1):
+        fig.add_trace(go.Scatter(
+            x=[bins[i] + 0.5] * hist_values[i],
+            y=[0] * hist_values[i],
+            mode='markers',
+            marker=dict(size=20, color='blue')
+        ))
 
+    # ブロックを上から落とすアニメーション
+    # 各ステップはフレームとして先に作っておき、再生はブラウザ側で行う（サーバーは1回描画するだけ）
+    fig.frames = [
+        go.Frame(data=[go.Scatter(x=[bins[i] + 0.5] * min(step + 1, hist_values[i]),
+                                  y=np.arange(min(step + 1, hist_values[i])))
+                       for i in range(len(bins) - 1)],
+                 name=str(step))
+        for step in range(max_height)
+    ]
+    fig.update_layout(updatemenus=[dict(
+        type="buttons",
+        showactive=False,
+        buttons=[dict(label="Start Animation",
+                      method="animate",
+                      args=[None, dict(frame=dict(duration=500, redraw=True), fromcurrent=False)])]
+    )])
+    return fig
+
+
+def animation_section():
+    # Streamlitのセットアップ
+    st.subheader("Falling Blocks Histogram")
+    plotly_chart(build_falling_blocks_figure())
+
+    histogram_animation_panel()
+
+    brownian_panel()
+
+
+# 高校科目の成績
+@st.cache_data(show_spinner=False)
+def load_school_scores():
+    return pd.read_csv('data/koukouseiseki.csv')
+
+
+@figure_cache
+def build_school_figures(vars2_selected):
+    df2 = load_school_scores()
+
+    # 散布図
+    #fig2 = px.scatter(x=df2['国語'],y=df2['数学'])
+    fig2 = px.scatter(x=df2['国語'],y=df2[vars2_selected])
+    fig2.update_layout(height=300,
+                       width=500,
+                       margin={'l': 20, 'r': 20, 't': 0, 'b': 0})
+
+    # ヒストグラム（度数はサーバー側で数えておき、棒だけを送る）
+    #fig8 = px.histogram(df2, x='国語', nbins=10, title='国語の得点分布')
+    counts, edges = get_school_histograms()[vars2_selected]
+    fig8 = go.Figure(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=np.diff(edges),
+                            hovertemplate='%{x}<br>頻度: %{y}<extra></extra>'))
+    fig8.update_layout(
+        xaxis_title='得点',
+        yaxis_title='頻度',
+        bargap=0)
+    return fig2, fig8
+
+
+# 箱ひげ図とヒストグラムの統計量も全科目分を一度だけ計算しておく
+@st.cache_data(show_spinner=False)
+def get_school_box_stats():
+    return box_stats(load_school_scores())
 
-# 
-import plotly.graph_objects as go
-df4 = pd.read_csv('https://raw.githubusercontent.com/plotly/datasets/master/2011_us_ag_exports.csv')
-fig12 = go.Figure(data=go.Choropleth(
-    locations=df4['code'], # Spatial coordinates
-    z = df4['total exports'].astype(float), # Data to be color-coded
-    locationmode = 'USA-states', # set of locations match entries in `locations`
-    colorscale = 'Reds',
-    colorbar_title = "Millions USD",))
-fig12.update_layout(
-    title_text = '2011 US Agriculture Exports by State',
-    geo_scope='usa', # limite map scope to USA
-)
-
-#
-import json
-from io import StringIO
-with open("data/N03-23_25_230101.geojson", encoding = 'utf-8') as f:
-    geojson = json.load(f)
-#geojson["features"][1]["properties"]
-
-shiga_pop_text = """市区町村名,男,女,計,世帯数
+
+@st.cache_data(show_spinner=False)
+def get_school_histograms():
+    return histograms(load_school_scores(), bins=10)
+
+
+# 相関行列は全科目分を一度だけ計算しておき、選択した科目の行・列を取り出して使う
+@st.cache_data(show_spinner=False)
+def get_school_correlations():
+    return correlations(load_school_scores())
+
+
+CORRELATION_METHODS = {"Pearson": "pearson", "Spearman": "spearman"}
+
+
+@figure_cache
+def build_school_corr_figure(vars2_multi_selected, method_label):
+    vars2_multi_selected = list(vars2_multi_selected)
+
+    # Correlation Matrix of kamoku in Content
+    corr, p = get_school_correlations()[CORRELATION_METHODS[method_label]]
+    df2_corr = corr.loc[vars2_multi_selected, vars2_multi_selected]
+    fig_corr2 = go.Figure([go.Heatmap(z=df2_corr.values,
+                                      x=df2_corr.index.values,
+                                      y=df2_corr.columns.values,
+                                      customdata=p.loc[vars2_multi_selected, vars2_multi_selected].values,
+                                      hovertemplate='%{x} - %{y}<br>r = %{z:.3f}<br>p = %{customdata:.3g}<extra></extra>')])
+    fig_corr2.update_layout(height=300,
+                            width=1000,
+                            margin={'l': 20, 'r': 20, 't': 0, 'b': 0})
+    return fig_corr2
+
+
+@figure_cache
+def build_school_multi_figures(vars2_multi_selected):
+    vars2_multi_selected = list(vars2_multi_selected)
+
+    # 箱ひげ図（四分位数・ひげ・外れ値はサーバー側で計算しておき、生の得点は送らない）
+    summary, outliers = get_school_box_stats()
+    colors = px.colors.qualitative.Plotly
+    fig7 = go.Figure()
+    for i, subject in enumerate(vars2_multi_selected):
+        color = colors[i % len(colors)]
+        row = summary.loc[subject]
+        fig7.add_trace(go.Box(x=[subject], q1=[row['q1']], median=[row['median']], q3=[row['q3']],
+                              lowerfence=[row['lowerfence']], upperfence=[row['upperfence']],
+                              name=subject, marker_color=color))
+        fig7.add_trace(go.Scatter(x=[subject] * len(outliers[subject]), y=outliers[subject], mode='markers',
+                                  name=subject, marker_color=color, showlegend=False))
+    #fig7 = px.box(df2_melted, x=vars2_multi_selected, y='得点', color='科目', title='各科目の得点分布')
+    fig7.update_layout(
+        title='各科目の得点分布',
+        xaxis_title='科目',
+        yaxis_title='得点',
+        showlegend=False)
+    return fig7
+
+
+# 各パネルは st.fragment にして、パネル内のウィジェット操作ではそのパネルだけを再実行する
+# （fragment内からサイドバーにウィジェットを置けないので、ウィジェットはパネルの先頭に置く）
+@st.fragment
+def school_scatter_panel(vars2):
+    vars2_selected = st.selectbox('散布図：高校科目', vars2)
+    fig2, fig8 = build_school_figures(vars2_selected)
+
+    left_column, right_column = st.columns(2)
+    left_column.subheader('散布図：国語と' + vars2_selected)
+    plotly_chart(fig2, left_column)
+    right_column.subheader('ヒストグラム' + vars2_selected)
+    plotly_chart(fig8, right_column)
+
+
+@st.fragment
+def school_multi_panel(vars2):
+    vars2_multi_selected = st.multiselect('相関行列：高校科目', vars2, default=vars2) # デフォルトは全部
+    method_label = st.radio('相関係数', list(CORRELATION_METHODS), horizontal=True)
+    fig7 = build_school_multi_figures(tuple(vars2_multi_selected))
+    fig_corr2 = build_school_corr_figure(tuple(vars2_multi_selected), method_label)
+
+    st.subheader('箱ひげ図')
+    plotly_chart(fig7)
+    st.subheader('高校科目の相関行列')
+    plotly_chart(fig_corr2)
+
+
+def school_section():
+    # data
+    df2 = load_school_scores()
+    vars2 = [var for var in df2.columns]
+
+    # 散布図・ヒストグラムは vars2_selected、相関行列・箱ひげ図は vars2_multi_selected だけに依存する
+    school_scatter_panel(vars2)
+    school_multi_panel(vars2)
+
+
+# 日経225
+NIKKEI_PATH = 'data/nikkei225.csv'
+NIKKEI_COLUMNS = ['始値', '高値', '安値', '終値']
+
+
+@st.cache_data(show_spinner=False)
+def load_nikkei():
+    # 桁区切りのカンマ・日付の解析・floatへの変換は読み込み時に1回だけ行う（行の順はCSVのまま）
+    return read_csv_cached(NIKKEI_PATH, thousands=',', index_col='日付', parse_dates=['日付'],
+                           date_format='%Y年%m月%d日', dtype={col: 'float64' for col in NIKKEI_COLUMNS})
+
+
+@figure_cache
+def build_nikkei_line(vars3_selected, x_range=None):
+    df3 = downsample_frame(load_nikkei(), None, [vars3_selected], DOWNSAMPLE_POINTS, x_range=x_range)
+
+    #（単一）折れ線グラフ
+    #fig3 = px.line(x=df3['日付'], y=df3['終値'])
+    fig3 = px.line(x=df3.index, y=df3[vars3_selected])
+    fig3.update_layout(height=300,
+                       width=500,
+                       margin={'l': 20, 'r': 20, 't': 0, 'b': 0})
+    return fig3
+
+
+@figure_cache
+def build_nikkei_multi_line(vars3_multi_selected, x_range=None):
+    df3 = downsample_frame(load_nikkei(), None, list(vars3_multi_selected), DOWNSAMPLE_POINTS, x_range=x_range)
+
+    #fig4 = px.line(df3[vars3_multi_selected])
+    #fig4.update_layout(height=300,
+    #                   width=1000,
+    #                   margin={'l': 20, 'r': 20, 't': 0, 'b': 0})
+
+    #（複数）折れ線グラフ
+    fig5 = px.line(df3, y=list(vars3_multi_selected), 
+                  labels={'value': '株価（円）', 'variable': '株価の種類'},
+                  #title="日経225株価の推移"
+                  )
+    fig5.update_layout(height=300,
+                       width=1000,
+                       margin={'l': 20, 'r': 20, 't': 0, 'b': 0})
+    return fig5
+
+
+@figure_cache
+def build_nikkei_figures():
+    df3 = load_nikkei()
+
+    #ウォーターフォール図
+    change = df3['終値'].diff()
+    change.iloc[0] = df3['終値'].iloc[0]
+    fig6 = go.Figure(go.Waterfall(
+        name="株価の変化",
+        orientation="v",
+        x=df3.index,
+        y=change,
+        connector={"line":{"color":"rgb(63, 63, 63)"}},
+        decreasing={"marker":{"color":"red"}},
+        increasing={"marker":{"color":"green"}},
+        totals={"marker":{"color":"blue"}},))
+    fig6.update_layout(
+        title="日経225株価のウォーターフォール図",
+        xaxis_title="日付",
+        yaxis_title="株価の変化（円）",
+        showlegend=True)
+
+    # 円グラフを作成
+    final_row = df3.iloc[-1]
+    final_values = [final_row['始値'], final_row['高値'], final_row['安値'], final_row['終値']]
+    fig9 = px.pie(values=final_values, names=['始値', '高値', '安値', '終値'], title='最終時点の株価')
+
+    # 棒グラフで作成
+    fig10 = go.Figure(data=[
+        go.Bar(name='始値', x=['始値'], y=[final_values[0]]),
+        go.Bar(name='高値', x=['高値'], y=[final_values[1]]),
+        go.Bar(name='安値', x=['安値'], y=[final_values[2]]),
+        go.Bar(name='終値', x=['終値'], y=[final_values[3]])])
+    fig10.update_layout(
+        title='最終時点の株価',
+        xaxis_title='種類',
+        yaxis_title='株価（円）',
+        barmode='group')
+    return fig6, fig9, fig10
+
+
+@st.fragment
+def nikkei_line_panel(vars3):
+    vars3_selected = st.selectbox('日経225の折れ線グラフ', vars3)
+    fig3 = build_nikkei_line(vars3_selected, selected_x_range('fig3'))
+    st.subheader('日経225: ' + vars3_selected)
+    timeseries_chart(fig3, 'fig3')
+
+
+@st.fragment
+def nikkei_multi_line_panel(vars3):
+    vars3_multi_selected = st.multiselect('日経225の折れ線グラフ（複数）', vars3, default=vars3)
+    fig5 = build_nikkei_multi_line(tuple(vars3_multi_selected), selected_x_range('fig5'))
+    st.subheader('日経225すべて')
+    timeseries_chart(fig5, 'fig5')
+
+
+def nikkei_section():
+    # data
+    df3 = load_nikkei()
+    vars3 = [var for var in df3.columns]
+
+    fig6, fig9, fig10 = build_nikkei_figures()
+
+    # Layout (Content)
+    left_column, right_column = st.columns(2)
+    with left_column:
+        nikkei_line_panel(vars3)
+    right_column.subheader('ウォーターフォール')
+    plotly_chart(fig6, right_column)
+
+    nikkei_multi_line_panel(vars3)
+
+    left_column2, right_column2 = st.columns(2)
+    left_column2.subheader('円グラフ')
+    plotly_chart(fig9, left_column2)
+    right_column2.subheader('棒グラフ')
+    plotly_chart(fig10, right_column2)
+
+
+# 滋賀県の市区町村別人口
+SHIGA_POP_TEXT = """市区町村名,男,女,計,世帯数
 大津市,160170,169871,330041,130143
 彦根市,53908,55368,109276,41257
 長浜市,39575,41263,80838,27937
@@ -474,403 +803,408 @@ shiga_pop_text = """市区町村名,男,女,計,世帯数
 豊郷町,3524,3681,7205,2574
 甲良町,3792,4162,7954,2425
 多賀町,3882,4251,8133,2640"""
-shiga_pop = pd.read_csv(StringIO(shiga_pop_text))
-shiga_pop.head()
-
-fig13 = px.choropleth_mapbox(
-    shiga_pop,
-    geojson=geojson,
-    locations="市区町村名",
-    color="計",
-    hover_name="市区町村名",
-    hover_data=["男", "女", "世帯数"],
-    featureidkey="properties.N03_004",
-    mapbox_style="carto-positron",
-    zoom=8,
-    center={"lat": 35.09, "lon": 136.18},
-    opacity=0.5,
-    width=800,
-    height=800,
-)
-
-# treemap
-df5 = px.data.tips()
-fig14 = px.treemap(df5, path=[px.Constant("all"), 'day', 'time', 'sex'], values='total_bill')
-fig14.update_traces(root_color="lightgrey")
-#fig14.update_layout(margin = dict(t=50, l=25, r=25, b=25))
-
-# area map
-df6 = px.data.iris()
-fig15 = px.area(df6, x="sepal_width", y="sepal_length",
-            color="species",
-            hover_data=['petal_width'],)
-
-
-# 散布図
-#fig2 = px.scatter(x=df2['国語'],y=df2['数学'])
-fig2 = px.scatter(x=df2['国語'],y=df2[vars2_selected])
-fig2.update_layout(height=300,
-                   width=500,
-                   margin={'l': 20, 'r': 20, 't': 0, 'b': 0})
-
-
-# contribution graph
-df8 = pd.read_csv('data/kisho_data.csv')
-
-
-#（単一）折れ線グラフ
-#fig3 = px.line(x=df3['日付'], y=df3['終値'])
-df3['日付'] = pd.to_datetime(df3['日付'], format='%Y年%m月%d日')
-fig3 = px.line(x=df3['日付'], y=df3[vars3_selected])
-fig3.update_layout(height=300,
-                   width=500,
-                   margin={'l': 20, 'r': 20, 't': 0, 'b': 0})
-
-#fig4 = px.line(df3[vars3_multi_selected])
-#fig4.update_layout(height=300,
-#                   width=1000,
-#                   margin={'l': 20, 'r': 20, 't': 0, 'b': 0})
-
-#（複数）折れ線グラフ
-df3['日付'] = pd.to_datetime(df3['日付'], format='%Y年%m月%d日')
-fig5 = px.line(df3, x='日付', y=vars3_multi_selected, 
-              labels={'value': '株価（円）', 'variable': '株価の種類'},
-              #title="日経225株価の推移"
-              )
-fig5.update_layout(height=300,
-                   width=1000,
-                   margin={'l': 20, 'r': 20, 't': 0, 'b': 0})
-
-# 折れ線
-df = px.data.stocks()
-fig31 = px.line(df, x='date', y="GOOG")
-st.subheader('折れ線')
-st.plotly_chart(fig31)
-st.write(df.head())
-
-df = px.data.gapminder().query("continent=='Oceania'")
-fig32 = px.line(df, x="year", y="lifeExp", color='country')
-st.plotly_chart(fig32)
-st.write(df.head())
-
-#ウォーターフォール図
-df3['終値'] = pd.to_numeric(df3['終値'].str.replace(',', ''))
-df3['変化'] = df3['終値'].diff()
-df3.at[0, '変化'] = df3.at[0, '終値']
-fig6 = go.Figure(go.Waterfall(
-    name="株価の変化",
-    orientation="v",
-    x=df3['日付'],
-    y=df3['変化'],
-    connector={"line":{"color":"rgb(63, 63, 63)"}},
-    decreasing={"marker":{"color":"red"}},
-    increasing={"marker":{"color":"green"}},
-    totals={"marker":{"color":"blue"}},))
-fig6.update_layout(
-    title="日経225株価のウォーターフォール図",
-    xaxis_title="日付",
-    yaxis_title="株価の変化（円）",
-    showlegend=True)
-
-
-# Correlation Matrix of kamoku in Content
-df2_corr = df2[vars2_multi_selected].corr()
-fig_corr2 = go.Figure([go.Heatmap(z=df2_corr.values,
-                                  x=df2_corr.index.values,
-                                  y=df2_corr.columns.values)])
-fig_corr2.update_layout(height=300,
-                        width=1000,
-                        margin={'l': 20, 'r': 20, 't': 0, 'b': 0})
-
-# 箱ひげ図
-df2_ = df2[vars2_multi_selected]
-df2_melted = df2_.melt(var_name='科目', value_name='得点')
-fig7 = px.box(df2_melted, x='科目', y='得点', color='科目', title='各科目の得点分布')
-#fig7 = px.box(df2_melted, x=vars2_multi_selected, y='得点', color='科目', title='各科目の得点分布')
-fig7.update_layout(
-    xaxis_title='科目',
-    yaxis_title='得点',
-    showlegend=False)
-
-# ヒストグラム
-fig8 = px.histogram(df2, x='国語', nbins=10, title='国語の得点分布')
-fig8 = px.histogram(df2, x=vars2_selected, nbins=10)
-fig8.update_layout(
-    xaxis_title='得点',
-    yaxis_title='頻度')
-
-
-# 円グラフを作成
-data = pd.read_csv('data/nikkei225.csv')
-#final_values = df3[vars3[1:]][:1]
-#final_values = df3.iloc[-1][['始値', '高値', '安値', '終値']].values
-final_values = [33193.05, 33299.39, 32693.18, 33288.29]
-fig9 = px.pie(values=final_values, names=['始値', '高値', '安値', '終値'], title='最終時点の株価')
-
-# 棒グラフで作成
-data['始値'] = pd.to_numeric(data['始値'].str.replace(',', ''))
-data['高値'] = pd.to_numeric(data['高値'].str.replace(',', ''))
-data['安値'] = pd.to_numeric(data['安値'].str.replace(',', ''))
-data['終値'] = pd.to_numeric(data['終値'].str.replace(',', ''))
-final_row = data.iloc[-1]
-final_values = [final_row['始値'], final_row['高値'], final_row['安値'], final_row['終値']]
-fig10 = go.Figure(data=[
-    go.Bar(name='始値', x=['始値'], y=[final_values[0]]),
-    go.Bar(name='高値', x=['高値'], y=[final_values[1]]),
-    go.Bar(name='安値', x=['安値'], y=[final_values[2]]),
-    go.Bar(name='終値', x=['終値'], y=[final_values[3]])])
-fig10.update_layout(
-    title='最終時点の株価',
-    xaxis_title='種類',
-    yaxis_title='株価（円）',
-    barmode='group')
-
-# bar chart
-import numpy as np
-np.random.seed(42) 
-random_x= np.random.randint(1,101,100) 
-random_y= np.random.randint(1,101,100) 
-fig16 = px.bar(random_x, random_y)
 
-df7 = px.data.iris()
-fig17 = px.bar(df7, x="sepal_width", y="sepal_length")
-fig18 = px.bar(df7, x="sepal_width", y="sepal_length", color="species",
-            hover_data=['petal_width'], barmode = 'stack')
+
+# 地図
+SHIGA_GEOJSON_PATH = Path("data/N03-23_25_230101.geojson")
+
+
+# 地物の索引は全セッションで共有する（初回は単純化したポリゴンをキャッシュに保存する）
+@st.cache_resource(show_spinner=False)
+def get_geo_index(path):
+    return load_index(path)
+
+
+US_COUNTIES_URL = 'https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json'
+# 全米を表示する図なので、1ピクセルより十分小さい誤差（度）で単純化する
+US_COUNTIES_TOLERANCE = 0.01
+
+
+# 郡の境界は一度だけ取得・単純化し、静的ファイル配信が有効ならそのURLを、無効ならGeoJSONそのものを返す
+@st.cache_resource(show_spinner=False)
+def get_us_counties():
+    counties = simplify_geojson(load_json(US_COUNTIES_URL), US_COUNTIES_TOLERANCE)
+    if st.get_option("server.enableStaticServing"):
+        return publish_geojson(counties, "us-counties.json")
+    return counties
+
+
+@figure_cache
+def build_map_figures():
+    # map graph
+    counties = get_us_counties()
+
+    df = read_csv("https://raw.githubusercontent.com/plotly/datasets/master/fips-unemp-16.csv",
+                       dtype={"fips": str})
+    fig11 = px.choropleth(df, geojson=counties, locations='fips', color='unemp',
+                               color_continuous_scale="Viridis",
+                               range_color=(0, 12),
+                               scope="usa",
+                               labels={'unemp':'unemployment rate'}
+                              )
+    fig11.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+
+
+    # 
+    df4 = read_csv('https://raw.githubusercontent.com/plotly/datasets/master/2011_us_ag_exports.csv')
+    fig12 = go.Figure(data=go.Choropleth(
+        locations=df4['code'], # Spatial coordinates
+        z = df4['total exports'].astype(float), # Data to be color-coded
+        locationmode = 'USA-states', # set of locations match entries in `locations`
+        colorscale = 'Reds',
+        colorbar_title = "Millions USD",))
+    fig12.update_layout(
+        title_text = '2011 US Agriculture Exports by State',
+        geo_scope='usa', # limite map scope to USA
+    )
+
+    #
+    from io import StringIO
+    shiga_pop = pd.read_csv(StringIO(SHIGA_POP_TEXT))
+    shiga_pop.head()
+
+    # 表示するズームに合った単純化済みのポリゴンのうち、表に出てくる市区町村の分だけを使う
+    zoom = 8
+    geojson = select_features(get_geo_index(SHIGA_GEOJSON_PATH), tolerance_for_zoom(zoom),
+                              "N03_004", shiga_pop["市区町村名"], prefecture="滋賀県")
+
+    fig13 = px.choropleth_mapbox(
+        shiga_pop,
+        geojson=geojson,
+        locations="市区町村名",
+        color="計",
+        hover_name="市区町村名",
+        hover_data=["男", "女", "世帯数"],
+        featureidkey="properties.N03_004",
+        mapbox_style="carto-positron",
+        zoom=zoom,
+        center={"lat": 35.09, "lon": 136.18},
+        opacity=0.5,
+        width=800,
+        height=800,
+    )
+    return fig11, fig12, fig13
+
+
+def map_section():
+    fig11, fig12, fig13 = build_map_figures()
+
+    st.subheader('Choropleth map using GeoJSON')
+    plotly_chart(fig11)
+    st.subheader('Choropleth Maps with goChoropleth')
+    plotly_chart(fig12)
+    st.subheader('Choropleth Maps with goChoropleth')
+    plotly_chart(fig13)
+
+
+# 気象データ
+@st.cache_data(show_spinner=False)
+def load_weather():
+    return pd.read_csv('data/kisho_data.csv')
 
 
 # (green) contribution graph
-# 日付を基に週番号と曜日を計算
-data3 = pd.read_csv('data/kisho_data.csv')
-vars3_2 = [var for var in data3.columns]
-vars3_2_selected = st.sidebar.selectbox('気象データの貢献グラフ', vars3_2[2:])
-
-data3['年月日'] = pd.to_datetime(data3['年月日'])
-data3['week'] = data3['年月日'].apply(lambda x: x.isocalendar()[1])
-data3['day_of_week'] = data3['年月日'].dt.dayofweek
-
-# ピボットテーブルを作成して行列を転置
-temperature_matrix = data3.pivot_table(values=vars3_2_selected, index='week', columns='day_of_week', aggfunc='mean').fillna(0)
-temperature_matrix = temperature_matrix.T
-custom_colorscale = [[0, 'black'],[1, 'green']]
-
-# Plotlyでヒートマップを作成（色を反転）
-fig19 = go.Figure(data=go.Heatmap(
-    z=temperature_matrix.values,
-    x=temperature_matrix.columns,
-    #y=['Sat', 'Fri', 'Thu', 'Wed', 'Tue', 'Mon', 'Sun'],
-    #y=list(range(7)),
-    y=list(range(6,-1,-1)),
-    colorscale=custom_colorscale,
-    #colorscale='Greens_r'
-    showscale=True
-))
-
-# グラフのレイアウトを設定して、セルを正方形にする
-fig19.update_layout(
-    title='Weekly Temperature Heatmap',
-    xaxis_nticks=52,
-    yaxis_nticks=7,
-    yaxis_title='Day of the Week',
-    xaxis_title='Week',
-    xaxis=dict(
-        tickmode='array',
-        tickvals=list(range(1, 53)),
-        ticktext=[str(i) for i in range(1, 53)]
-    ),
-    yaxis=dict(
-        tickmode='array',
-        #tickvals=list(range(7)),
-        tickvals=list(range(6,-1,-1)),
-        #ticktext=['Sat', 'Fri', 'Thu', 'Wed', 'Tue', 'Mon', 'Sun'],
-        #ticktext=['Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat'],
-        ticktext=['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'],
-        scaleanchor='x',  # Make y-axis scale anchor to x-axis to make cells square
-        scaleratio=1     # Ensure the ratio is 1 to make cells square
-    ),
-    autosize=False,
-    width=1400,
-    height=300
-)
-
-
-# contribution graph (with gap)
-# ピボットテーブルを作成して行列を転置
-rainfall_matrix = data3.pivot_table(values=vars3_2_selected, index='week', columns='day_of_week', aggfunc='mean').fillna(0)
-rainfall_matrix_transposed = rainfall_matrix.T
-
-# 元の行列を拡張し、値が入る場所に元のデータを配置し、それ以外の場所はNaNで埋める
-expanded_matrix = np.full((rainfall_matrix_transposed.shape[0] * 2, rainfall_matrix_transposed.shape[1] * 2), np.nan)
-expanded_matrix[::2, ::2] = rainfall_matrix_transposed.values
-
-# Plotlyでヒートマップを作成（カスタムカラースケール）
-fig20 = go.Figure(data=go.Heatmap(
-    z=expanded_matrix,
-    x=np.arange(0.5, len(rainfall_matrix.columns) + 0.5, 1),
-    #y=np.arange(0.5, 7 + 0.5, 0.5),
-    #y=np.arange(7, 0, -0.5),
-    y=np.arange(6.5, 0, -1),
-    colorscale=custom_colorscale,
-    zmin=rainfall_matrix_transposed.values.min(),
-    zmax=rainfall_matrix_transposed.values.max(),
-    showscale=True
-))
-
-fig20.update_layout(
-    title='Weekly Rainfall Heatmap',
-    xaxis_nticks=52,
-    yaxis_nticks=7,
-    yaxis_title='Day of the Week',
-    xaxis_title='Week',
-    xaxis=dict(
-        tickmode='array',
-        tickvals=np.arange(0.5, len(rainfall_matrix.columns) + 0.5, 1),
-        ticktext=[str(i) for i in range(1, 53)]
-    ),
-    yaxis=dict(
-        tickmode='array',
-        #tickvals=np.arange(0.5, 7 + 0.5, 1),
-        #ticktext=['Sat', 'Fri', 'Thu', 'Wed', 'Tue', 'Mon', 'Sun'],
-        #tickvals=np.arange(7.5, 0.5, -1),
-        tickvals=np.arange(6.5, 0, -1),
-        ticktext=['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'],
-        scaleanchor='x',  # Make y-axis scale anchor to x-axis to make cells square
-        scaleratio=1     # Ensure the ratio is 1 to make cells square
-    ),
-    autosize=False,
-    width=1400,
-    height=400
-)
-
-
-# another contribution graph
-# 元の行列を拡張し、値が入る場所に元のデータを配置し、それ以外の場所はNaNで埋める
-gap = 0.05  # 隙間のサイズを調整
-expanded_matrix = np.full((rainfall_matrix_transposed.shape[0] * 2 - 1, rainfall_matrix_transposed.shape[1] * 2 - 1), np.nan)
-expanded_matrix[::2, ::2] = rainfall_matrix_transposed.values
-
-# Plotlyでヒートマップを作成（カスタムカラースケール）
-fig21 = go.Figure(data=go.Heatmap(
-    z=expanded_matrix,
-    x=np.arange(0.5, len(rainfall_matrix.columns), 0.5) * (1 + gap),
-    y=np.arange(0.5, 7, 0.5) * (1 + gap),
-    colorscale=custom_colorscale,
-    zmin=rainfall_matrix_transposed.values.min(),
-    zmax=rainfall_matrix_transposed.values.max(),
-    showscale=True
-))
-
-fig21.update_layout(
-    title='Weekly Rainfall Heatmap (Transposed and Color Reversed)',
-    xaxis_nticks=52,
-    yaxis_nticks=7,
-    yaxis_title='Day of the Week',
-    xaxis_title='Week',
-    xaxis=dict(
-        tickmode='array',
-        tickvals=np.arange(0.5, len(rainfall_matrix.columns) * (1 + gap), 1 + gap),
-        ticktext=[str(i) for i in range(1, 53)]
-    ),
-    yaxis=dict(
-        tickmode='array',
-        tickvals=np.arange(0.5, 7 * (1 + gap), 1 + gap),
-        ticktext=['Sat', 'Fri', 'Thu', 'Wed', 'Tue', 'Mon', 'Sun'],
-        scaleanchor='x',  # Make y-axis scale anchor to x-axis to make cells square
-        scaleratio=1     # Ensure the ratio is 1 to make cells square
-    ),
-    autosize=False,
-    width=1400,
-    height=400
-)
-
-
-# Layout (Content)
-left_column, right_column = st.columns(2)
-left_column.subheader('日経225: ' + vars3_selected)
-left_column.plotly_chart(fig3)
-right_column.subheader('散布図：国語と' + vars2_selected)
-right_column.plotly_chart(fig2)
-
-left, center, right = st.columns(3)
-left.subheader('ウォーターフォール')
-left.plotly_chart(fig6)
-center.subheader('箱ひげ図')
-center.plotly_chart(fig7)
-right.subheader('ヒストグラム' + vars2_selected)
-right.plotly_chart(fig8)
-
-st.subheader('日経225すべて')
-st.plotly_chart(fig5)
-st.subheader('高校科目の相関行列')
-st.plotly_chart(fig_corr2)
-
-left_column2, right_column2 = st.columns(2)
-left_column2.subheader('円グラフ')
-left_column2.plotly_chart(fig9)
-right_column2.subheader('棒グラフ')
-right_column2.plotly_chart(fig10)
-
-
-st.subheader('Choropleth map using GeoJSON')
-st.plotly_chart(fig11)
-st.subheader('Choropleth Maps with goChoropleth')
-st.plotly_chart(fig12)
-st.subheader('Choropleth Maps with goChoropleth')
-st.plotly_chart(fig13)
-
-st.subheader('treemap')
-st.plotly_chart(fig14)
-st.subheader('filled area chart')
-st.plotly_chart(fig15)
-st.subheader('bar chart')
-st.plotly_chart(fig16)
-st.subheader('bar chart with dataframe')
-st.plotly_chart(fig17)
-st.subheader('stack bar chart with dataframe')
-st.plotly_chart(fig18)
-
-st.subheader('Weekly Temperature Heatmap: ' + vars3_2_selected)
-st.plotly_chart(fig19)
-st.subheader('Weekly Temperature Heatmap')
-st.plotly_chart(fig20)
+# 日付を基に週と曜日を求め、数値の列すべての 曜日×週 の行列をまとめて作っておく
+@st.cache_data(show_spinner=False)
+def get_weather_grids():
+    return calendar_grids(load_weather(), '年月日')
+
+
+@figure_cache
+def build_weather_figures(vars3_2_selected):
+    weeks, iso_weeks, grids = get_weather_grids()
+    n_weeks = len(weeks)
+    week_labels = [str(week) for week in iso_weeks['week']]
+
+    # 曜日×週の行列（値のない日は0）
+    temperature_matrix = np.nan_to_num(grids[vars3_2_selected])
+    custom_colorscale = [[0, 'black'],[1, 'green']]
+
+    # Plotlyでヒートマップを作成（色を反転）
+    fig19 = go.Figure(data=go.Heatmap(
+        z=temperature_matrix,
+        x=list(range(1, n_weeks + 1)),
+        #y=['Sat', 'Fri', 'Thu', 'Wed', 'Tue', 'Mon', 'Sun'],
+        #y=list(range(7)),
+        y=list(range(6,-1,-1)),
+        colorscale=custom_colorscale,
+        #colorscale='Greens_r'
+        showscale=True
+    ))
 
+    # グラフのレイアウトを設定して、セルを正方形にする
+    fig19.update_layout(
+        title='Weekly Temperature Heatmap',
+        xaxis_nticks=52,
+        yaxis_nticks=7,
+        yaxis_title='Day of the Week',
+        xaxis_title='Week',
+        xaxis=dict(
+            tickmode='array',
+            tickvals=list(range(1, n_weeks + 1)),
+            ticktext=week_labels
+        ),
+        yaxis=dict(
+            tickmode='array',
+            #tickvals=list(range(7)),
+            tickvals=list(range(6,-1,-1)),
+            #ticktext=['Sat', 'Fri', 'Thu', 'Wed', 'Tue', 'Mon', 'Sun'],
+            #ticktext=['Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat'],
+            ticktext=['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'],
+            scaleanchor='x',  # Make y-axis scale anchor to x-axis to make cells square
+            scaleratio=1     # Ensure the ratio is 1 to make cells square
+        ),
+        autosize=False,
+        width=1400,
+        height=300
+    )
 
 
-#### google trend visualization
+    # contribution graph (with gap)
+    # fig19 と同じ 曜日×週 の行列を使う（ピボットし直さない）
+    rainfall_matrix_transposed = temperature_matrix
+
+    # 元の行列を拡張し、値が入る場所に元のデータを配置し、それ以外の場所はNaNで埋める
+    expanded_matrix = np.full((rainfall_matrix_transposed.shape[0] * 2, rainfall_matrix_transposed.shape[1] * 2), np.nan)
+    expanded_matrix[::2, ::2] = rainfall_matrix_transposed
+
+    # Plotlyでヒートマップを作成（カスタムカラースケール）
+    fig20 = go.Figure(data=go.Heatmap(
+        z=expanded_matrix,
+        x=np.arange(0.5, n_weeks + 0.5, 1),
+        #y=np.arange(0.5, 7 + 0.5, 0.5),
+        #y=np.arange(7, 0, -0.5),
+        y=np.arange(6.5, 0, -1),
+        colorscale=custom_colorscale,
+        zmin=rainfall_matrix_transposed.min(),
+        zmax=rainfall_matrix_transposed.max(),
+        showscale=True
+    ))
 
-#from datetime import datetime
-#now = datetime.now()
-#date_str = now.strftime('%Y-%m-%d')
-
-from datetime import datetime, timedelta
-now = datetime.now()
-yesterday = now - timedelta(days=1)
-date_str = yesterday.strftime('%Y-%m-%d')
-
-pytrends = TrendReq(hl='ja-JP', tz=360)
-kw_list = ["AI","ChatGPT"]
-#kw_list = ["データサイエンス"]
-pytrends.build_payload(kw_list, timeframe='2020-01-01 2024-08-05', geo='JP')
-df = pytrends.interest_over_time().drop(columns=['isPartial'])
-df.reset_index(inplace=True)
-st.dataframe(df)
-
-fig33 = px.line(df, x='date', y=kw_list)
-st.subheader('google trend')
-st.plotly_chart(fig33)
-
-pytrends = TrendReq(hl='ja-JP', tz=360)
-kw_list = ["コロナ"]
-start_date = '2024-06-01'
-date_range = f'{start_date} {date_str}'
-#pytrends.build_payload(kw_list, timeframe=date_range, geo='JP')
-pytrends.build_payload(kw_list, timeframe='2024-06-01 2024-08-05', geo='JP')
-
-df = pytrends.interest_over_time()
-df.drop(columns=['isPartial'], inplace=True)
-df.reset_index(inplace=True)
-#st.dataframe(df)
-
-fig34 = px.line(df, x='date', y=kw_list)
-st.subheader('google trend')
-st.plotly_chart(fig34)
+    fig20.update_layout(
+        title='Weekly Rainfall Heatmap',
+        xaxis_nticks=52,
+        yaxis_nticks=7,
+        yaxis_title='Day of the Week',
+        xaxis_title='Week',
+        xaxis=dict(
+            tickmode='array',
+            tickvals=np.arange(0.5, n_weeks + 0.5, 1),
+            ticktext=week_labels
+        ),
+        yaxis=dict(
+            tickmode='array',
+            #tickvals=np.arange(0.5, 7 + 0.5, 1),
+            #ticktext=['Sat', 'Fri', 'Thu', 'Wed', 'Tue', 'Mon', 'Sun'],
+            #tickvals=np.arange(7.5, 0.5, -1),
+            tickvals=np.arange(6.5, 0, -1),
+            ticktext=['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'],
+            scaleanchor='x',  # Make y-axis scale anchor to x-axis to make cells square
+            scaleratio=1     # Ensure the ratio is 1 to make cells square
+        ),
+        autosize=False,
+        width=1400,
+        height=400
+    )
 
+
+    # another contribution graph
+    # 元の行列を拡張し、値が入る場所に元のデータを配置し、それ以外の場所はNaNで埋める
+    gap = 0.05  # 隙間のサイズを調整
+    expanded_matrix = np.full((rainfall_matrix_transposed.shape[0] * 2 - 1, rainfall_matrix_transposed.shape[1] * 2 - 1), np.nan)
+    expanded_matrix[::2, ::2] = rainfall_matrix_transposed
+
+    # Plotlyでヒートマップを作成（カスタムカラースケール）
+    fig21 = go.Figure(data=go.Heatmap(
+        z=expanded_matrix,
+        x=np.arange(0.5, n_weeks, 0.5) * (1 + gap),
+        y=np.arange(0.5, 7, 0.5) * (1 + gap),
+        colorscale=custom_colorscale,
+        zmin=rainfall_matrix_transposed.min(),
+        zmax=rainfall_matrix_transposed.max(),
+        showscale=True
+    ))
+
+    fig21.update_layout(
+        title='Weekly Rainfall Heatmap (Transposed and Color Reversed)',
+        xaxis_nticks=52,
+        yaxis_nticks=7,
+        yaxis_title='Day of the Week',
+        xaxis_title='Week',
+        xaxis=dict(
+            tickmode='array',
+            tickvals=np.arange(0.5, n_weeks * (1 + gap), 1 + gap),
+            ticktext=week_labels
+        ),
+        yaxis=dict(
+            tickmode='array',
+            tickvals=np.arange(0.5, 7 * (1 + gap), 1 + gap),
+            ticktext=['Sat', 'Fri', 'Thu', 'Wed', 'Tue', 'Mon', 'Sun'],
+            scaleanchor='x',  # Make y-axis scale anchor to x-axis to make cells square
+            scaleratio=1     # Ensure the ratio is 1 to make cells square
+        ),
+        autosize=False,
+        width=1400,
+        height=400
+    )
+    return fig19, fig20, fig21
+
+
+@st.fragment
+def weather_panel(vars3_2):
+    vars3_2_selected = st.selectbox('気象データの貢献グラフ', vars3_2)
+    fig19, fig20, fig21 = build_weather_figures(vars3_2_selected)
+
+    st.subheader('Weekly Temperature Heatmap: ' + vars3_2_selected)
+    plotly_chart(fig19)
+    st.subheader('Weekly Temperature Heatmap')
+    plotly_chart(fig20)
+
+
+def weather_section():
+    weeks, iso_weeks, grids = get_weather_grids()
+    vars3_2 = list(grids)
+    weather_panel(vars3_2)
+
+
+# その他のグラフ
+def other_section():
+    # contour plot
+    fig27 = go.Figure(data=go.Contour(
+                z=[[10, 10.625, 12.5, 15.625, 20],
+                [5.625, 6.25, 8.125, 11.25, 15.625],
+                [2.5, 3.125, 5., 8.125, 12.5],
+                [0.625, 1.25, 3.125, 6.25, 10.625],
+                [0, 0.625, 2.5, 5.625, 10]]
+                ))
+    st.subheader('contour plot')
+    plotly_chart(fig27)
+
+    # funnel plot
+    fig22 = go.Figure(go.Funnel(
+        y = ["Website visit", "Downloads", "Potential customers", "Requested price", "invoice sent"],
+        x = [39, 27.4, 20.6, 11, 2]))
+
+    st.subheader('funnel plot')
+    plotly_chart(fig22)
+
+    # 折れ線
+    df = px.data.stocks()
+    fig31 = px.line(downsample_frame(df, 'date', ['GOOG'], DOWNSAMPLE_POINTS, x_range=selected_x_range('fig31')),
+                    x='date', y="GOOG")
+    st.subheader('折れ線')
+    timeseries_chart(fig31, 'fig31')
+    st.write(df.head())
+
+    df = px.data.gapminder().query("continent=='Oceania'")
+    fig32 = px.line(downsample_frame(df, 'year', ['lifeExp'], DOWNSAMPLE_POINTS, by='country',
+                                     x_range=selected_x_range('fig32')),
+                    x="year", y="lifeExp", color='country')
+    timeseries_chart(fig32, 'fig32')
+    st.write(df.head())
+
+    # treemap
+    df5 = px.data.tips()
+    fig14 = px.treemap(df5, path=[px.Constant("all"), 'day', 'time', 'sex'], values='total_bill')
+    fig14.update_traces(root_color="lightgrey")
+    #fig14.update_layout(margin = dict(t=50, l=25, r=25, b=25))
+
+    # area map
+    df6 = px.data.iris()
+    fig15 = px.area(df6, x="sepal_width", y="sepal_length",
+                color="species",
+                hover_data=['petal_width'],)
+
+    # bar chart
+    np.random.seed(42) 
+    random_x= np.random.randint(1,101,100) 
+    random_y= np.random.randint(1,101,100) 
+    fig16 = px.bar(random_x, random_y)
+
+    df7 = px.data.iris()
+    fig17 = px.bar(df7, x="sepal_width", y="sepal_length")
+    fig18 = px.bar(df7, x="sepal_width", y="sepal_length", color="species",
+                hover_data=['petal_width'], barmode = 'stack')
+
+    st.subheader('treemap')
+    plotly_chart(fig14)
+    st.subheader('filled area chart')
+    plotly_chart(fig15)
+    st.subheader('bar chart')
+    plotly_chart(fig16)
+    st.subheader('bar chart with dataframe')
+    plotly_chart(fig17)
+    st.subheader('stack bar chart with dataframe')
+    plotly_chart(fig18)
+
+
+#### google trend visualization
+# ディスクのキャッシュは trends.get_interest が管理し（古くなったら裏で取り直す）、ここでは読み込みを少しの間だけ使い回す
+TRENDS_RELOAD_SECONDS = 60
+
+
+@st.cache_data(ttl=TRENDS_RELOAD_SECONDS, show_spinner="Googleトレンドを取得しています...")
+def get_trends(kw_list, timeframe, geo):
+    return get_interest(list(kw_list), timeframe, geo)
+
+
+def trends_status(kw_list, timeframe, geo):
+    if is_refreshing(list(kw_list), timeframe, geo):
+        st.caption('最新のデータを取得しています。取得が終わるまでは前回の結果を表示します。')
+
+
+def trends_section():
+    #from datetime import datetime
+    #now = datetime.now()
+    #date_str = now.strftime('%Y-%m-%d')
+
+    from datetime import datetime, timedelta
+    now = datetime.now()
+    yesterday = now - timedelta(days=1)
+    date_str = yesterday.strftime('%Y-%m-%d')
+
+    kw_list = ["AI","ChatGPT"]
+    #kw_list = ["データサイエンス"]
+    df = get_trends(tuple(kw_list), '2020-01-01 2024-08-05', 'JP').drop(columns=['isPartial'])
+    df.reset_index(inplace=True)
+    trends_status(kw_list, '2020-01-01 2024-08-05', 'JP')
+    st.dataframe(df)
+
+    fig33 = px.line(downsample_frame(df, 'date', kw_list, DOWNSAMPLE_POINTS, x_range=selected_x_range('fig33')),
+                    x='date', y=kw_list)
+    st.subheader('google trend')
+    timeseries_chart(fig33, 'fig33')
+
+    kw_list = ["コロナ"]
+    start_date = '2024-06-01'
+    date_range = f'{start_date} {date_str}'
+    #df = get_trends(tuple(kw_list), date_range, 'JP')
+    df = get_trends(tuple(kw_list), '2024-06-01 2024-08-05', 'JP')
+    df.drop(columns=['isPartial'], inplace=True)
+    df.reset_index(inplace=True)
+    #st.dataframe(df)
+
+    fig34 = px.line(downsample_frame(df, 'date', kw_list, DOWNSAMPLE_POINTS, x_range=selected_x_range('fig34')),
+                    x='date', y=kw_list)
+    st.subheader('google trend')
+    timeseries_chart(fig34, 'fig34')
+
+
+# 選択したセクションだけを実行する（他のセクションのデータ取得やグラフ作成は行わない）
+SECTIONS = {
+    "コロナ定点観測": covid_section,
+    "ネットワークグラフ": network_section,
+    "分布": distribution_section,
+    "アニメーション": animation_section,
+    "地図": map_section,
+    "日経225": nikkei_section,
+    "高校科目": school_section,
+    "気象データ": weather_section,
+    "Googleトレンド": trends_section,
+    "その他のグラフ": other_section,
+}
+
+# Layout (Sidebar)
+st.sidebar.markdown("## サイドバーの使い方")
+selected_section = st.sidebar.radio("表示するセクション", list(SECTIONS))
+SECTIONS[selected_section]()
@@ -0,0 +1,21 @@
+# 貢献グラフ（曜日×週のヒートマップ）用の行列を作る処理
+# 週は ISO 週（月曜始まり）で数え、年をまたいでも同じ週番号の列が重ならないように週の初日（月曜日）で区別する
+import pandas as pd
+
+
+def calendar_grids(df, date_column):
+    # 日付から ISO の年・週・曜日をまとめて求め、数値の列すべてを1回のピボットで 曜日(7)×週 の行列にする
+    # 戻り値は 週の初日の一覧・各週の ISO 年と週番号・列名ごとの行列（値のない日は NaN）
+    dates = pd.to_datetime(df[date_column])
+    iso = dates.dt.isocalendar()
+    day = iso["day"].astype(int) - 1  # 0 = 月曜日
+    week_start = dates.dt.normalize() - pd.to_timedelta(day, unit="D")
+
+    columns = list(df.select_dtypes("number").columns)
+    table = (df[columns].assign(_day=day.to_numpy(), _week=week_start.to_numpy())
+             .pivot_table(index="_day", columns="_week", values=columns, aggfunc="mean"))
+
+    # データのない週も列として残し、週の並びが途切れないようにする
+    weeks = pd.date_range(week_start.min(), week_start.max(), freq="7D")
+    grids = {col: table[col].reindex(index=range(7), columns=weeks).to_numpy() for col in columns}
+    return weeks, weeks.isocalendar()[["year", "week"]], grids
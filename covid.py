@@ -0,0 +1,376 @@
+# 厚労省の定点観測PDFから都道府県別テーブルを取り出す処理
+# PDFはメモリ上で開き、抽出結果はPDFのハッシュをキーにParquetで保存する
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urljoin
+
+import fitz
+import pandas as pd
+from bs4 import BeautifulSoup
+
+from datasource import CACHE_DIR, DEFAULT_TTL, fetch, write_atomic
+
+TABLE_DIR = CACHE_DIR / "covid"
+SERIES_PATH = TABLE_DIR / "series.parquet"
+BACKFILL_STATE_PATH = TABLE_DIR / "backfill.json"
+LAYOUT_PATH = TABLE_DIR / "layouts.json"
+
+# 対象ページのURL
+MHLW_URL = "https://www.mhlw.go.jp/stf/seisakunitsuite/bunya/0000121431_00461.html"
+
+# 都道府県別の表を見分ける文字列（空白を除いたページ本文・表の1列目に対して判定）
+# 北海道か沖縄県を含むページを候補にし、表が2ページに分かれている場合は北海道の表と次のページの沖縄県の表をつなぐ
+TABLE_SIGNATURE = ("都道府県", "北海道", "沖縄県")
+
+# 表の1列目の都道府県名（見出しの「都道府県」は除く）
+PREFECTURE_PATTERN = re.compile(r"^.{1,3}[都道府県]$")
+
+# 表抽出に使うプロセス数（Noneなら os.cpu_count()）
+EXTRACT_WORKERS = None
+
+# バックフィル時の同時ダウンロード数
+MAX_WORKERS = 8
+
+SERIES_COLUMNS = ["都道府県", "週", "週番号", "値", "source"]
+
+# バックフィルの時系列に付ける、PDFの公開順を表す列（そのPDFに含まれる最新の週番号）
+PUBLISHED_COLUMN = "公開週"
+
+
+class TableNotFound(ValueError):
+    # PDFに都道府県別の表がない（バックフィルでは以後このPDFをスキップする）
+    pass
+
+
+def list_pdf_urls(url=MHLW_URL, ttl=DEFAULT_TTL):
+    html = fetch(url, ttl=ttl).content
+
+    # BeautifulSoupでHTMLを解析
+    soup = BeautifulSoup(html, "html.parser")
+
+    # すべてのリンクを検索
+    links = soup.find_all("a")
+
+    # PDFファイルのURLを抽出
+    pdf_urls = [link.get("href") for link in links if link.get("href") and ".pdf" in link.get("href")]
+
+    # 相対URLを絶対URLに変換
+    return [urljoin(url, pdf_url) for pdf_url in pdf_urls]
+
+
+def _unique_columns(columns):
+    # Parquetは列名が文字列かつ一意である必要がある
+    seen = {}
+    result = []
+    for i, col in enumerate(columns):
+        name = str(col).replace("\n", "") if col else f"列{i}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}_{seen[name]}"
+        else:
+            seen[name] = 0
+        result.append(name)
+    return result
+
+
+def _week_columns(columns0, columns):
+    # 1行目の年（結合セル）を右方向に埋めて週の列名に付ける。年をまたぐ系列で週が衝突しないようにする
+    year = ""
+    result = [columns[0]]
+    for top, col in zip(columns0[1:], columns[1:]):
+        top = str(top).replace("\n", "") if top else ""
+        if re.search(r"\d", top):
+            year = top
+        col = str(col).replace("\n", "") if col else ""
+        result.append(col if not year or col.startswith(year) else year + col)
+    return result
+
+
+def _write_parquet(df, path):
+    write_atomic(path, lambda tmp: df.to_parquet(tmp, index=False))
+
+
+def _write_json(obj, path):
+    text = json.dumps(obj, ensure_ascii=False)
+    write_atomic(path, lambda tmp: tmp.write_text(text, encoding="utf-8"))
+
+
+def _normalize(text):
+    return re.sub(r"\s+", "", text or "")
+
+
+def _first_column(table_data):
+    return "".join(_normalize(row[0]) for row in table_data if row)
+
+
+def _is_prefecture_table(table_data):
+    # 1列目に都道府県名が並んでいる表を対象とする
+    first_column = _first_column(table_data)
+    return all(word in first_column for word in TABLE_SIGNATURE[1:])
+
+
+def _is_partial_table(table_data):
+    # 2ページに分かれた表の片方（北海道か沖縄県の一方だけを含む）
+    first_column = _first_column(table_data)
+    return any(word in first_column for word in TABLE_SIGNATURE[1:])
+
+
+def _data_rows(table_data):
+    # 続きのページで繰り返される見出しの行を除く
+    for i, row in enumerate(table_data):
+        cell = _normalize(row[0]) if row else ""
+        if cell != "都道府県" and PREFECTURE_PATTERN.match(cell):
+            return table_data[i:]
+    return []
+
+
+def _join_split_tables(found):
+    # 北海道を含み沖縄県を含まない表に、次のページにある沖縄県を含む列数の同じ表の行をつなぐ
+    # つないだ表は位置を記録しないので、表の番号を None にする
+    tables = []
+    for i, (page_index, table_index, table_data) in enumerate(found):
+        if _is_prefecture_table(table_data):
+            tables.append((page_index, table_index, table_data))
+            continue
+        if TABLE_SIGNATURE[1] not in _first_column(table_data):
+            continue
+        for next_page, _, rest in found[i + 1:]:
+            if next_page != page_index + 1:
+                continue
+            first_column = _first_column(rest)
+            if (TABLE_SIGNATURE[2] in first_column and TABLE_SIGNATURE[1] not in first_column
+                    and len(rest[0]) == len(table_data[0])):
+                tables.append((page_index, None, table_data + _data_rows(rest)))
+                break
+    return tables
+
+
+def _layout_key(doc):
+    # 数字を除いた各ページの見出し部分とページ数から、PDFのレイアウトを識別する
+    heads = [re.sub(r"\d", "", _normalize(page.get_text("text")))[:40] for page in doc]
+    return f"{doc.page_count}:" + hashlib.sha1("|".join(heads).encode("utf-8")).hexdigest()
+
+
+# layouts.json の読み書きはバックフィルの複数スレッドから行われるので、読み込みから書き込みまでをロックする
+_layout_lock = threading.Lock()
+
+
+def _load_layouts():
+    # 読めないファイルは空のキャッシュとして扱う（位置を探し直すだけで済む）
+    try:
+        return json.loads(LAYOUT_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_layout(key, page_index, table_index):
+    with _layout_lock:
+        layouts = _load_layouts()
+        layouts[key] = [page_index, table_index]
+        _write_json(layouts, LAYOUT_PATH)
+
+
+def _extract_pages(pdf_bytes, page_indexes):
+    # ワーカープロセス側で実行する。fitzの文書はプロセス間で渡せないのでバイト列から開き直す
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    found = []
+    for page_index in page_indexes:
+        for table_index, tab in enumerate(doc[page_index].find_tables()):
+            table_data = tab.extract()
+            if _is_partial_table(table_data):
+                found.append((page_index, table_index, table_data))
+    return found
+
+
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+
+def _get_extract_pool():
+    # プロセスプールは1つだけ作って共有する（バックフィルの各スレッドから呼ばれても EXTRACT_WORKERS 個まで）
+    # Streamlitやバックフィルのスレッドが動いているプロセスを fork すると子プロセスが止まることがあるので spawn で起動する
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            _extract_pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS or os.cpu_count() or 1,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        return _extract_pool
+
+
+def find_tables(pdf_bytes):
+    # 本文に北海道か沖縄県を含むページだけを候補にし、find_tables() をページごとに共有のプロセスプールで並列実行する
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    candidates = [i for i, page in enumerate(doc)
+                  if any(word in _normalize(page.get_text("text")) for word in TABLE_SIGNATURE[1:])]
+    if len(candidates) <= 1:
+        return _join_split_tables(_extract_pages(pdf_bytes, candidates))
+
+    workers = min(EXTRACT_WORKERS or os.cpu_count() or 1, len(candidates))
+    chunks = [candidates[i::workers] for i in range(workers)]
+    pool = _get_extract_pool()
+    try:
+        results = list(pool.map(_extract_pages, [pdf_bytes] * workers, chunks))
+    except BrokenProcessPool:
+        # 壊れたプールは捨てて次回作り直し、今回はこのプロセスで処理する
+        global _extract_pool
+        with _extract_pool_lock:
+            if _extract_pool is pool:
+                _extract_pool = None
+        results = [_extract_pages(pdf_bytes, candidates)]
+    return _join_split_tables(sorted(found for chunk in results for found in chunk))
+
+
+def _table_to_frame(table_data):
+    columns0 = table_data[0]
+    columns = _week_columns(columns0, table_data[1])
+    columns[0] = "都道府県"
+    data_rows = table_data[2:]
+    return pd.DataFrame(data_rows, columns=_unique_columns(columns))
+
+
+def parse_table(pdf_bytes):
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    key = _layout_key(doc)
+
+    # 同じレイアウトのPDFは前回見つけたページ・表の位置をまず試す
+    with _layout_lock:
+        known = _load_layouts().get(key)
+    if known is not None:
+        page_index, table_index = known
+        tables = doc[page_index].find_tables().tables if page_index < doc.page_count else []
+        if table_index < len(tables):
+            table_data = tables[table_index].extract()
+            if _is_prefecture_table(table_data):
+                return _table_to_frame(table_data)
+
+    found = find_tables(pdf_bytes)
+    if not found:
+        raise TableNotFound("都道府県別の表が見つかりません")
+    page_index, table_index, table_data = found[0]
+    if table_index is not None:
+        _save_layout(key, page_index, table_index)
+    return _table_to_frame(table_data)
+
+
+def load_table(pdf_bytes, sha256):
+    # find_tables() は公開されたPDFごとに1回だけ実行する
+    path = TABLE_DIR / f"{sha256}.parquet"
+    if path.exists():
+        return pd.read_parquet(path)
+    df = parse_table(pdf_bytes)
+    _write_parquet(df, path)
+    return df
+
+
+def _week_number(label):
+    # "2024年32週" のような列名から並べ替え用の整数（年*100+週）を作る
+    numbers = [int(n) for n in re.findall(r"\d+", label)]
+    if len(numbers) >= 2 and numbers[0] > 1900:
+        return numbers[0] * 100 + numbers[1]
+    if numbers:
+        return numbers[0]
+    return None
+
+
+def to_long(df, source=None):
+    # 横持ちの文字列の表を、空白を除いた都道府県名・数値の縦持ちに変換する
+    long_df = df.melt(id_vars=["都道府県"], var_name="週", value_name="値")
+    long_df["都道府県"] = long_df["都道府県"].map(_normalize)
+    long_df["週番号"] = long_df["週"].map(_week_number).astype("Int64")
+    long_df["値"] = pd.to_numeric(long_df["値"], errors="coerce")
+    long_df["source"] = source
+    return long_df[SERIES_COLUMNS]
+
+
+def by_prefecture(long_df):
+    # 都道府県をインデックスにしておき、選択の切り替えは .loc で取り出すだけにする
+    # 都道府県は表に出てきた順（北から南）の順序付きカテゴリにして、その順に並べる
+    prefectures = pd.Categorical(long_df["都道府県"], categories=long_df["都道府県"].unique(), ordered=True)
+    return long_df.assign(都道府県=prefectures).sort_values(["都道府県", "週番号"]).set_index("都道府県")
+
+
+def _with_published(long_df):
+    long_df[PUBLISHED_COLUMN] = long_df.groupby("source")["週番号"].transform("max")
+    return long_df
+
+
+def load_series():
+    if SERIES_PATH.exists():
+        series = pd.read_parquet(SERIES_PATH)
+        # 公開週の列がない以前の形式は、PDFごとの最新の週番号から作る
+        return series if PUBLISHED_COLUMN in series else _with_published(series)
+    return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in
+                         zip(SERIES_COLUMNS + [PUBLISHED_COLUMN],
+                             ["object", "object", "Int64", "float64", "object", "Int64"])})
+
+
+def _load_state():
+    # 読めないときは処理済みなしとして扱う（取得・解析済みのPDFはキャッシュから読むだけになる）
+    try:
+        return json.loads(BACKFILL_STATE_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {"done": []}
+
+
+def _fetch_and_parse(url):
+    pdf = fetch(url, ttl=None)
+    return _with_published(to_long(load_table(pdf.content, pdf.sha256), source=url))
+
+
+def backfill(pdf_urls, max_workers=MAX_WORKERS):
+    # 一覧のPDFを並列に取得・解析し、都道府県×週で重複を除いた時系列にまとめる
+    # 処理済みのPDFは記録しておき、次回以降は新しいPDFだけを追加する
+    series = load_series()
+    state = _load_state()
+    done = set(state["done"])
+    todo = [url for url in pdf_urls if url not in done]
+    if not todo:
+        return series
+
+    order = {url: i for i, url in enumerate(pdf_urls)}
+    parsed = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(_fetch_and_parse, url): url for url in todo}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                parsed[url] = future.result()
+            except TableNotFound:
+                # 定点観測の表を含まないPDFは以後スキップする
+                parsed[url] = None
+            except Exception as e:
+                # 通信エラーや壊れたキャッシュ・PDFなどは次回に再試行する
+                print(f"{url}: {e}", file=sys.stderr)
+                continue
+            done.add(url)
+
+    # 同じ都道府県・週は、取り込んだ回によらず公開の新しいPDFの値（改訂値）を優先する
+    # 公開週が同じPDFどうしは一覧の順（新しい順）で比べ、一覧にない過去のPDFはそれより後にする
+    new_frames = [parsed[url] for url in sorted(parsed, key=order.get) if parsed[url] is not None]
+    if new_frames:
+        series = pd.concat(new_frames + [series], ignore_index=True)
+        position = series["source"].map(order).fillna(len(order))
+        series = (series.assign(_position=position)
+                  .sort_values([PUBLISHED_COLUMN, "_position"], ascending=[False, True], kind="stable")
+                  .drop_duplicates(subset=["都道府県", "週"], keep="first")
+                  .drop(columns="_position"))
+        # 週の中では表の行の順（北から南）を保つ
+        series = series.sort_values("週番号", kind="stable", ignore_index=True)
+        _write_parquet(series, SERIES_PATH)
+
+    state["done"] = sorted(done)
+    _write_json(state, BACKFILL_STATE_PATH)
+    return series
+
+
+if __name__ == "__main__":
+    # python covid.py で一覧のPDFをすべて取り込む
+    series = backfill(list_pdf_urls(ttl=0))
+    print(f"{series['source'].nunique()} PDFs, {len(series)} rows -> {SERIES_PATH}")
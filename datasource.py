@@ -0,0 +1,198 @@
+# リモートデータ取得用のキャッシュ層
+# URLごとのメタ情報（ETag / Last-Modified / 取得時刻）と、内容のハッシュで保存した本体をディスクに保持する
+# data/mirror 以下にURLと同じパス構成でファイルを置いておけば、ネットワークに出ずにそれを使う
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import pandas as pd
+import requests
+
+CACHE_DIR = Path(os.environ.get("SIMPLECHAT_CACHE_DIR", "cache"))
+HTTP_DIR = CACHE_DIR / "http"
+OBJECT_DIR = HTTP_DIR / "objects"
+TABLE_DIR = CACHE_DIR / "tables"
+
+MIRROR_DIR = Path(os.environ.get("SIMPLECHAT_MIRROR_DIR", "data/mirror"))
+
+# 1 ならネットワークに出ず、ミラーとキャッシュだけを使う
+OFFLINE = os.environ.get("SIMPLECHAT_OFFLINE") == "1"
+
+# 1 なら取得した内容をミラーにも書き出す（オフライン環境へ持ち込む用）
+RECORD = os.environ.get("SIMPLECHAT_MIRROR_RECORD") == "1"
+
+# 再検証までの秒数（環境変数で変更可）
+DEFAULT_TTL = float(os.environ.get("SIMPLECHAT_FETCH_TTL", 3600))
+TIMEOUT = 30
+
+FetchResult = namedtuple("FetchResult", ["content", "sha256", "from_cache"])
+
+_session = requests.Session()
+
+
+class OfflineError(ConnectionError):
+    pass
+
+
+def mirror_path(url):
+    # https://host/a/b.csv -> data/mirror/host/a/b.csv
+    parts = urlsplit(url)
+    path = parts.path.lstrip("/")
+    if not path or path.endswith("/"):
+        path += "index.html"
+    if parts.query:
+        path += "_" + hashlib.sha1(parts.query.encode("utf-8")).hexdigest()[:10]
+    return MIRROR_DIR / parts.netloc / path
+
+
+def _meta_path(url):
+    return HTTP_DIR / (hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+
+def _object_path(sha):
+    return OBJECT_DIR / sha[:2] / sha
+
+
+def _load_meta(url):
+    path = _meta_path(url)
+    if not path.exists():
+        return None
+    try:
+        meta = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    # 本体が消えている場合はキャッシュなし扱い
+    if not _object_path(meta["sha256"]).exists():
+        return None
+    return meta
+
+
+def write_atomic(path, write):
+    # write(一時ファイルのパス) で書き終えてから置き換える（読み手が書きかけのファイルを見ないようにする）
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + f".{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _write_atomic(path, data):
+    write_atomic(path, lambda tmp: tmp.write_bytes(data))
+
+
+def _save_meta(url, meta):
+    _write_atomic(_meta_path(url), json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+
+
+def _store(content):
+    sha = hashlib.sha256(content).hexdigest()
+    path = _object_path(sha)
+    if not path.exists():
+        _write_atomic(path, content)
+    return sha
+
+
+def fetch(url, ttl=DEFAULT_TTL):
+    # ttl秒以内ならネットワークに出ずにキャッシュを返す（ttl=None は無期限＝不変のURL向け）
+    # 期限切れなら If-None-Match / If-Modified-Since で条件付きGETし、304なら本体を再利用する
+    # ミラーにあればそれが最優先
+    mirrored = mirror_path(url)
+    if mirrored.exists():
+        content = mirrored.read_bytes()
+        return FetchResult(content, hashlib.sha256(content).hexdigest(), True)
+
+    meta = _load_meta(url)
+    now = time.time()
+    if meta is not None and (OFFLINE or ttl is None or now - meta["fetched_at"] < ttl):
+        return FetchResult(_object_path(meta["sha256"]).read_bytes(), meta["sha256"], True)
+    if OFFLINE:
+        raise OfflineError(f"{url} はミラーにもキャッシュにもありません（{mirrored}）")
+
+    headers = {}
+    if meta is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    response = _session.get(url, headers=headers, timeout=TIMEOUT)
+    if response.status_code == 304 and meta is not None:
+        meta["fetched_at"] = now
+        _save_meta(url, meta)
+        return FetchResult(_object_path(meta["sha256"]).read_bytes(), meta["sha256"], True)
+    response.raise_for_status()  # エラーが発生した場合、例外を投げる
+
+    content = response.content
+    sha = _store(content)
+    _save_meta(url, {
+        "url": url,
+        "sha256": sha,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "fetched_at": now,
+    })
+    if RECORD:
+        _write_atomic(mirrored, content)
+    return FetchResult(content, sha, False)
+
+
+def read_csv(url, ttl=None, **kwargs):
+    return pd.read_csv(io.BytesIO(fetch(url, ttl=ttl).content), **kwargs)
+
+
+def load_json(url, ttl=None):
+    return json.loads(fetch(url, ttl=ttl).content)
+
+
+def read_csv_cached(path, **kwargs):
+    # ローカルのCSVは型を付けて解析した結果をParquetで保存し、次からはそれを読む
+    # ファイル名に元ファイルの更新時刻と読み込みオプションを含めるので、CSVが更新されれば読み直す
+    path = Path(path)
+    options = hashlib.sha1(repr(sorted(kwargs.items())).encode("utf-8")).hexdigest()[:10]
+    cached = TABLE_DIR / f"{path.stem}-{path.stat().st_mtime_ns}-{options}.parquet"
+    if cached.exists():
+        return pd.read_parquet(cached)
+
+    df = pd.read_csv(path, **kwargs)
+    for old in TABLE_DIR.glob(f"{path.stem}-*-{options}.parquet"):
+        old.unlink(missing_ok=True)
+    write_atomic(cached, df.to_parquet)
+    return df
+
+
+def _trends_path(kw_list, timeframe, geo):
+    name = "_".join([geo, timeframe.replace(" ", "_"), "+".join(kw_list)])
+    return MIRROR_DIR / "trends" / f"{name}.csv"
+
+
+def interest_over_time(kw_list, timeframe, geo, query):
+    # Googleトレンドの結果もミラーに置いたCSVがあればそれを使い、なければ query(kw_list, timeframe, geo) で取得する
+    path = _trends_path(kw_list, timeframe, geo)
+    if path.exists():
+        return pd.read_csv(path, index_col="date", parse_dates=["date"])
+    if OFFLINE:
+        raise OfflineError(f"{kw_list} {timeframe} {geo} はミラーにありません（{path}）")
+
+    df = query(kw_list, timeframe, geo)
+    if RECORD:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        df.to_csv(path)
+    return df
+
+
+if __name__ == "__main__":
+    # python datasource.py URL [URL ...] で指定したURLをミラーに保存する
+    for url in sys.argv[1:]:
+        path = mirror_path(url)
+        content = fetch(url, ttl=0).content
+        _write_atomic(path, content)
+        print(f"{url} -> {path}")
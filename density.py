@@ -0,0 +1,84 @@
+# バイオリン図・リッジライン用のカーネル密度推定
+# 密度はサーバー側で計算し、ブラウザには評価点ごとの曲線だけを送る
+import numpy as np
+from scipy.signal import fftconvolve
+
+# 密度を評価する点の数
+GRID_POINTS = 256
+
+# サンプル数×評価点数がこれを超えるグループは、格子点にビン分けしてFFTで畳み込む
+EXACT_LIMIT = 2_000_000
+
+# ビン分けに使う内部の格子の間隔（バンド幅に対する比）と点の数の上限
+BIN_STEP = 1 / 3
+MAX_BINS = 1 << 16
+
+
+def bandwidth(values):
+    # plotly のバイオリン図と同じ Silverman の目安
+    n = len(values)
+    std = values.std(ddof=1) if n > 1 else 0.0
+    q1, q3 = np.percentile(values, [25, 75])
+    spread = min(std, (q3 - q1) / 1.349) or std or 1.0
+    return 1.059 * spread * n ** -0.2
+
+
+def kde(values, bw=None, grid_points=GRID_POINTS):
+    # ガウスカーネルの密度を [最小値 - 2bw, 最大値 + 2bw] の等間隔の点で評価する
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    bw = bandwidth(values) if bw is None else bw
+    grid = np.linspace(values.min() - 2 * bw, values.max() + 2 * bw, grid_points)
+    if len(values) * grid_points <= EXACT_LIMIT:
+        z = (grid[:, np.newaxis] - values[np.newaxis, :]) / bw
+        density = np.exp(-0.5 * z ** 2).sum(axis=1)
+    else:
+        # 各サンプルを両隣の格子点に距離に応じて振り分け（線形ビニング）、格子上のカーネルと畳み込む
+        # 格子の間隔がバンド幅より粗いとカーネルを表せないので、バンド幅の BIN_STEP 倍以下の細かい格子で計算して補間する
+        bins = int(np.clip(np.ceil((grid[-1] - grid[0]) / (bw * BIN_STEP)) + 1, grid_points, MAX_BINS))
+        fine = np.linspace(grid[0], grid[-1], bins)
+        step = fine[1] - fine[0]
+        position = (values - fine[0]) / step
+        left = np.floor(position).astype(np.int64).clip(0, bins - 2)
+        weight = position - left
+        counts = (np.bincount(left, weights=1 - weight, minlength=bins)
+                  + np.bincount(left + 1, weights=weight, minlength=bins))
+        half = int(np.ceil(4 * bw / step))
+        kernel = np.exp(-0.5 * (np.arange(-half, half + 1) * step / bw) ** 2)
+        # 離散化したカーネルの面積を1にする（格子が上限で粗くなっても密度の積分が1になるように）
+        kernel /= kernel.sum() * step
+        density = np.interp(grid, fine, fftconvolve(counts, kernel, mode="same"))
+        return grid, np.maximum(density, 0) / len(values)
+    return grid, density / (len(values) * bw * np.sqrt(2 * np.pi))
+
+
+def grouped_kde(df, value, by, grid_points=GRID_POINTS, max_samples=0):
+    # 1回の groupby でグループごとの密度・件数・平均・四分位数をまとめて求める（グループは出てきた順）
+    # 件数が max_samples 以下のグループは、点を描くためのサンプルも返す。値がひとつもないグループは含めない
+    result = {}
+    for key, series in df.groupby(by, sort=False)[value]:
+        values = series.dropna().to_numpy(dtype=np.float64)
+        if not len(values):
+            continue
+        grid, density = kde(values, grid_points=grid_points)
+        result[key] = {
+            "grid": grid, "density": density, "count": len(values), "mean": values.mean(),
+            "quartiles": np.percentile(values, [25, 50, 75]),
+        }
+        if len(values) <= max_samples:
+            result[key]["samples"] = values
+    return result
+
+
+def violin_outline(grid, density, position, scale, side="both"):
+    # 塗りつぶし用の閉じた多角形の座標（値の軸, 位置の軸）を返す
+    # 密度に scale を掛けたものが位置の軸方向の幅になる。side は "both" / "positive" / "negative"
+    width = density * scale
+    values = np.r_[grid, grid[::-1]]
+    if side == "positive":
+        positions = np.r_[position + width, np.full(len(grid), position)]
+    elif side == "negative":
+        positions = np.r_[position - width, np.full(len(grid), position)]
+    else:
+        positions = np.r_[position + width, (position - width)[::-1]]
+    return values, positions
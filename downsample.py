@@ -0,0 +1,101 @@
+# 折れ線グラフ用の間引き
+# 系列を画面の幅程度の点数に減らしてから描画する（Largest-Triangle-Three-Buckets と バケットごとの最小・最大）
+import numpy as np
+import pandas as pd
+
+# LTTBの前に最小・最大で絞り込むときの倍率（出力点数のこの倍まで減らしてからLTTBをかける）
+PRESELECT_FACTOR = 4
+
+
+def minmax_indices(y, n_out):
+    # 点を n_out/2 個のバケットに分け、各バケットの最小と最大の点を残す（外れ値やスパイクを落とさない）
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    n_buckets = max(n_out // 2, 1)
+    if n <= n_out:
+        return np.arange(n)
+    size = -(-n // n_buckets)
+    padded = np.full(n_buckets * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(n_buckets, size)
+    # NaN は選ばれないように ±inf に置き換える（バケットがすべて NaN なら先頭の点になる）
+    lows = np.where(np.isnan(padded), np.inf, padded).argmin(axis=1)
+    highs = np.where(np.isnan(padded), -np.inf, padded).argmax(axis=1)
+    offsets = np.arange(n_buckets) * size
+    indices = np.concatenate([[0, n - 1], offsets + lows, offsets + highs])
+    return np.unique(indices[indices < n])
+
+
+def lttb_indices(x, y, n_out):
+    # Largest-Triangle-Three-Buckets。始点と終点を残し、残りを n_out-2 個のバケットに分けて、
+    # 前に選んだ点と次のバケットの平均点とで作る三角形の面積が最大になる点を各バケットから1つ選ぶ
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    counts = np.diff(edges)
+    # 各バケットの平均点（最後のバケットの「次」は終点）
+    mean_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts
+    mean_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / counts
+    next_x = np.r_[mean_x[1:], x[-1]]
+    next_y = np.r_[mean_y[1:], y[-1]]
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    # 選んだ点が次のバケットの計算に使われるのでバケットの間は順に処理し、バケット内は一括で計算する
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs((x[a] - next_x[i]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y[i] - y[a]))
+        a = lo + int(np.argmax(np.nan_to_num(area, nan=-1.0)))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample_indices(x, y, n_out):
+    # 長い系列は先に最小・最大で PRESELECT_FACTOR * n_out 点まで減らしてから LTTB をかける
+    n = len(y)
+    if n <= n_out:
+        return np.arange(n)
+    if n > PRESELECT_FACTOR * n_out:
+        candidates = minmax_indices(y, PRESELECT_FACTOR * n_out)
+        return candidates[lttb_indices(np.asarray(x)[candidates], np.asarray(y)[candidates], n_out)]
+    return lttb_indices(x, y, n_out)
+
+
+def _numeric(values):
+    # 日付は数値（ナノ秒）にして面積の計算に使う
+    values = pd.Series(values)
+    if not pd.api.types.is_numeric_dtype(values):
+        values = pd.to_datetime(values).astype("datetime64[ns]").astype("int64")
+    return values.to_numpy(dtype=np.float64)
+
+
+def _in_range(values, x_range):
+    values = pd.Series(values)
+    lo, hi = x_range
+    if not pd.api.types.is_numeric_dtype(values):
+        values, lo, hi = pd.to_datetime(values), pd.Timestamp(lo), pd.Timestamp(hi)
+    return (values >= lo).to_numpy() & (values <= hi).to_numpy()
+
+
+def downsample_frame(df, x, columns, n_out, by=None, x_range=None):
+    # x 列（None ならインデックス）に対する columns の各系列を n_out 点程度に間引いた行だけを返す
+    # x_range を渡すとその範囲の行に絞ってから間引くので、拡大した範囲は細かく描ける
+    # by を指定すると、グループ（px の color に使う列）ごとに間引く
+    x_values = df.index if x is None else df[x]
+    if x_range is not None:
+        df = df[_in_range(x_values, x_range)]
+        x_values = df.index if x is None else df[x]
+    if by is not None:
+        groups = [downsample_frame(group, x, columns, n_out) for _, group in df.groupby(by, sort=False)]
+        return pd.concat(groups) if groups else df
+    if len(df) <= n_out:
+        return df
+    x_numeric = _numeric(x_values)
+    keep = np.unique(np.concatenate([downsample_indices(x_numeric, df[col].to_numpy(dtype=np.float64), n_out)
+                                     for col in columns]))
+    return df.iloc[keep]
@@ -0,0 +1,205 @@
+# 地図用のGeoJSONの前処理
+# ポリゴンを複数の許容誤差で単純化して座標を丸め、都道府県ごとのファイルと索引にしてキャッシュに保存しておく
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+from datasource import CACHE_DIR, write_atomic
+
+GEO_DIR = CACHE_DIR / "geo"
+
+# 単純化の許容誤差（度）。細かい順
+TOLERANCES = (0.0002, 0.001, 0.005)
+
+# Streamlitの静的ファイル配信（server.enableStaticServing）で配るディレクトリ
+STATIC_DIR = Path("static")
+
+# 地物を引くのに使うプロパティ（都道府県名・市区町村名・行政区域コード）
+INDEX_KEYS = ("N03_001", "N03_004", "N03_007")
+
+
+def simplify_ring(ring, tolerance):
+    # Douglas-Peucker法。再帰の代わりにスタックで区間を処理し、距離の計算は区間ごとにまとめて行う
+    points = np.asarray(ring, dtype=np.float64)
+    n = len(points)
+    if n <= 4:
+        return points
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = points[start], points[end]
+        inner = points[start + 1:end]
+        dx, dy = b - a
+        norm = np.hypot(dx, dy)
+        if norm == 0:
+            # 閉じたリングの始点と終点は同じ点なので、そこからの距離を使う
+            dist = np.hypot(inner[:, 0] - a[0], inner[:, 1] - a[1])
+        else:
+            dist = np.abs(dx * (inner[:, 1] - a[1]) - dy * (inner[:, 0] - a[0])) / norm
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            mid = start + 1 + i
+            keep[mid] = True
+            stack.append((start, mid))
+            stack.append((mid, end))
+    return points[keep]
+
+
+def quantize(points, decimals):
+    # 座標を丸め、丸めたことで重なった連続する点を除く
+    points = np.round(points, decimals)
+    changed = np.r_[True, np.any(points[1:] != points[:-1], axis=1)]
+    return points[changed]
+
+
+def _decimals(tolerance):
+    # 許容誤差より1桁細かい桁まで残す
+    return int(np.ceil(-np.log10(tolerance))) + 1
+
+
+def _simplify_polygon(rings, tolerance, decimals):
+    # 外周がつぶれたポリゴンは None、つぶれた穴は捨てる
+    result = []
+    for ring in rings:
+        points = quantize(simplify_ring(ring, tolerance), decimals) if tolerance else quantize(np.asarray(ring), decimals)
+        if len(points) < 4:
+            if not result:
+                return None
+            continue
+        result.append(points.tolist())
+    return result
+
+
+def simplify_geometry(geometry, tolerance):
+    decimals = _decimals(tolerance)
+    polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+    simplified = [p for p in (_simplify_polygon(rings, tolerance, decimals) for rings in polygons) if p]
+    if not simplified:
+        # すべてつぶれる小さな地物は単純化せずに丸めるだけにする
+        simplified = [p for p in (_simplify_polygon(rings, 0, decimals) for rings in polygons) if p]
+    if len(simplified) == 1:
+        return {"type": "Polygon", "coordinates": simplified[0]}
+    return {"type": "MultiPolygon", "coordinates": simplified}
+
+
+def simplify_geojson(geojson, tolerance):
+    # id など geometry 以外の項目はそのまま残す
+    features = [
+        {**feature, "geometry": simplify_geometry(feature["geometry"], tolerance)}
+        for feature in geojson["features"] if feature.get("geometry")
+    ]
+    return {"type": "FeatureCollection", "features": features}
+
+
+def tolerance_for_zoom(zoom):
+    # 地図の1ピクセルあたりの度数（512ピクセルのタイル）を超えない範囲で、いちばん粗い許容誤差を選ぶ
+    degrees_per_pixel = 360 / (512 * 2 ** zoom)
+    usable = [t for t in TOLERANCES if t <= degrees_per_pixel]
+    return max(usable) if usable else min(TOLERANCES)
+
+
+def merge_features(features):
+    # 同じ市区町村の複数のポリゴン（島や飛び地で地物が分かれている）を1つの MultiPolygon の地物にまとめる
+    merged = {}
+    for feature in features:
+        geometry = feature.get("geometry")
+        if not geometry:
+            continue
+        props = feature["properties"]
+        polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+        key = props.get("N03_007") or "|".join(str(props.get(k)) for k in ("N03_001", "N03_003", "N03_004"))
+        if key in merged:
+            merged[key]["geometry"]["coordinates"].extend(polygons)
+        else:
+            merged[key] = {"type": "Feature", "properties": props,
+                           "geometry": {"type": "MultiPolygon", "coordinates": list(polygons)}}
+    return list(merged.values())
+
+
+def _store_dir(path):
+    return GEO_DIR / path.stem
+
+
+def _write_json(path, obj):
+    text = json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+    write_atomic(path, lambda tmp: tmp.write_text(text, encoding="utf-8"))
+
+
+def build_store(path):
+    # 市区町村ごとにまとめた地物を、許容誤差ごと・都道府県ごとのファイルに分けて保存する
+    # index.json には各地物の都道府県・市区町村名・コードと、どのファイルの何番目かを記録する
+    stat = path.stat()
+    store = _store_dir(path)
+    with open(path, encoding="utf-8") as f:
+        features = merge_features(json.load(f)["features"])
+
+    shards = sorted({feature["properties"].get("N03_001") or "" for feature in features})
+    shard_of = {name: i for i, name in enumerate(shards)}
+    by_shard = [[] for _ in shards]
+    entries = []
+    for feature in features:
+        props = feature["properties"]
+        shard = shard_of[props.get("N03_001") or ""]
+        entries.append({**{key: props.get(key) for key in INDEX_KEYS},
+                        "shard": shard, "position": len(by_shard[shard])})
+        by_shard[shard].append(feature)
+
+    shutil.rmtree(store, ignore_errors=True)
+    for tolerance in TOLERANCES:
+        for shard, shard_features in enumerate(by_shard):
+            simplified = simplify_geojson({"features": shard_features}, tolerance)["features"]
+            _write_json(store / str(tolerance) / f"{shard}.json", simplified)
+    # index.json は最後に書き、これがあれば保存が完了しているとみなす
+    index = {"mtime": stat.st_mtime, "size": stat.st_size, "shards": shards, "features": entries}
+    _write_json(store / "index.json", index)
+    return index
+
+
+def load_index(path):
+    # 元ファイルの更新時刻とサイズが変わっていなければ前回の結果を使い、変わっていれば作り直す
+    stat = path.stat()
+    index_path = _store_dir(path) / "index.json"
+    index = None
+    if index_path.exists():
+        index = json.loads(index_path.read_text(encoding="utf-8"))
+        if index["mtime"] != stat.st_mtime or index["size"] != stat.st_size:
+            index = None
+    if index is None:
+        index = build_store(path)
+
+    # プロパティの値から地物の位置を引く辞書
+    lookup = {key: {} for key in INDEX_KEYS}
+    for entry in index["features"]:
+        for key in INDEX_KEYS:
+            lookup[key].setdefault(entry[key], []).append(entry)
+    index["lookup"] = lookup
+    index["dir"] = str(_store_dir(path))
+    return index
+
+
+def select_features(index, tolerance, key, values, prefecture=None):
+    # values に含まれる地物だけを、必要な都道府県のファイルからだけ読み出す
+    # （市区町村名は全国では重複するので、prefecture で都道府県を絞り込める）
+    entries = [entry for value in dict.fromkeys(values) for entry in index["lookup"][key].get(value, [])
+               if prefecture is None or entry["N03_001"] == prefecture]
+    shards = {}
+    features = []
+    for entry in entries:
+        if entry["shard"] not in shards:
+            shard_path = Path(index["dir"]) / str(tolerance) / f"{entry['shard']}.json"
+            shards[entry["shard"]] = json.loads(shard_path.read_text(encoding="utf-8"))
+        features.append(shards[entry["shard"]][entry["position"]])
+    return {"type": "FeatureCollection", "features": features}
+
+
+def publish_geojson(geojson, name):
+    # 静的ファイルとして書き出し、アプリからの相対URLを返す
+    # 図にはURLだけを埋め込み、ジオメトリはブラウザが一度取得してキャッシュする
+    _write_json(STATIC_DIR / "geo" / name, geojson)
+    return f"app/static/geo/{name}"
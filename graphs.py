@@ -0,0 +1,133 @@
+# ネットワークグラフ用の処理
+# networkx の Python ループの代わりに、KD木と NumPy の一括処理でグラフと描画用の座標を作る
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+# 媒介中心性の近似で、始点数×辺の数がこの程度に収まるようにする
+BETWEENNESS_EDGE_BUDGET = 8_000_000
+
+
+def random_geometric_graph(n, radius, seed=None):
+    # 単位正方形にn個の点を置き、距離がradius以下の点の組を辺にする
+    rng = np.random.default_rng(seed)
+    pos = rng.random((n, 2))
+    edges = cKDTree(pos).query_pairs(radius, output_type="ndarray")
+    return pos, edges
+
+
+def edge_coordinates(pos, edges):
+    # 辺ごとに [始点, 終点, 区切り] を並べる（plotlyは NaN を None と同じく線の切れ目として扱う）
+    n_edges = len(edges)
+    edge_x = np.full(3 * n_edges, np.nan)
+    edge_y = np.full(3 * n_edges, np.nan)
+    edge_x[0::3] = pos[edges[:, 0], 0]
+    edge_x[1::3] = pos[edges[:, 1], 0]
+    edge_y[0::3] = pos[edges[:, 0], 1]
+    edge_y[1::3] = pos[edges[:, 1], 1]
+    return edge_x, edge_y
+
+
+def adjacency(n, edges):
+    # 無向グラフの隣接行列（CSR形式の疎行列）
+    rows = np.concatenate([edges[:, 0], edges[:, 1]])
+    cols = np.concatenate([edges[:, 1], edges[:, 0]])
+    data = np.ones(len(rows), dtype=np.float64)
+    return sparse.csr_matrix((data, (rows, cols)), shape=(n, n))
+
+
+def degree(A):
+    return np.diff(A.indptr)
+
+
+def clustering(A):
+    # 各ノードの三角形の数 = (A @ A) と A の要素積の行和 / 2
+    deg = degree(A)
+    triangles = np.asarray((A @ A).multiply(A).sum(axis=1)).ravel() / 2
+    possible = deg * (deg - 1) / 2
+    return np.divide(triangles, possible, out=np.zeros(len(deg)), where=possible > 0)
+
+
+def pagerank(A, alpha=0.85, tol=1e-6, max_iter=100):
+    # 疎行列とベクトルの積によるべき乗法
+    n = A.shape[0]
+    deg = degree(A).astype(np.float64)
+    inv_deg = np.divide(1.0, deg, out=np.zeros(n), where=deg > 0)
+    dangling = deg == 0
+    rank = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        previous = rank
+        rank = alpha * (A.T @ (rank * inv_deg) + rank[dangling].sum() / n) + (1 - alpha) / n
+        if np.abs(rank - previous).sum() < n * tol:
+            break
+    return rank
+
+
+def _neighbors(A, frontier, n):
+    # frontier（始点ごとにずらした番号 source_index * n + node）から出る辺を
+    # (始点, 終点) の配列としてまとめて取り出す
+    local = frontier % n
+    starts = A.indptr[local]
+    counts = A.indptr[local + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    src = np.repeat(frontier, counts)
+    dst = A.indices[offsets + np.arange(counts.sum())] + (src - src % n)
+    return src, dst
+
+
+def approximate_betweenness(A, k=None, seed=None, batch=8):
+    # Brandesの方法をk個の始点だけで行う近似
+    # BFSは階層ごとにまとめて処理し、さらにbatch個の始点を同時に進めてPythonのループ回数を減らす
+    n = A.shape[0]
+    if k is None:
+        # 1始点あたり全辺をなめるので、辺の数に応じて始点の数を決める
+        k = int(np.clip(BETWEENNESS_EDGE_BUDGET // max(A.nnz, 1), 8, 64))
+    rng = np.random.default_rng(seed)
+    sources = rng.choice(n, size=min(k, n), replace=False)
+    betweenness = np.zeros(n)
+    for start in range(0, len(sources), batch):
+        chunk = sources[start:start + batch]
+        frontier = np.arange(len(chunk)) * n + chunk
+        dist = np.full(len(chunk) * n, -1)
+        sigma = np.zeros(len(chunk) * n)
+        slot = np.zeros(len(chunk) * n, dtype=np.int64)
+        dist[frontier] = 0
+        sigma[frontier] = 1
+        frontiers = [frontier]
+        levels = []
+        level = 0
+        while True:
+            level += 1
+            src, dst = _neighbors(A, frontier, n)
+            dist[dst[dist[dst] < 0]] = level
+            on_path = dist[dst] == level
+            src, dst = src[on_path], dst[on_path]
+            if not len(dst):
+                break
+            # ソートを使わずに重複を除く：各ノードに最後に書き込まれた位置を代表として残す
+            index = np.arange(len(dst))
+            slot[dst] = index
+            frontier = dst[slot[dst] == index]
+            slot[frontier] = np.arange(len(frontier))
+            sigma[frontier] = np.bincount(slot[dst], weights=sigma[src], minlength=len(frontier))
+            frontiers.append(frontier)
+            levels.append((src, dst))
+        delta = np.zeros(len(chunk) * n)
+        for (src, dst), parents in zip(reversed(levels), reversed(frontiers[:-1])):
+            slot[parents] = np.arange(len(parents))
+            delta[parents] += np.bincount(slot[src], weights=sigma[src] / sigma[dst] * (1 + delta[dst]),
+                                          minlength=len(parents))
+        delta[frontiers[0]] = 0
+        betweenness += delta.reshape(len(chunk), n).sum(axis=0)
+    # networkx の betweenness_centrality(normalized=True) と同じ尺度にそろえる
+    if n > 2:
+        betweenness *= n / len(sources) / ((n - 1) * (n - 2))
+    return betweenness
+
+
+METRICS = {
+    "degree": degree,
+    "clustering": clustering,
+    "pagerank": pagerank,
+    "betweenness": approximate_betweenness,
+}
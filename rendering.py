@@ -0,0 +1,52 @@
+# plotlyの図の描画方式
+# 点の数が多い図はSVGのトレースではブラウザが固まるので、同じ見た目のままWebGLのトレースに置き換える
+import os
+
+import plotly.graph_objects as go
+
+# 図全体の点の数がこれを超えたらWebGLで描く（環境変数で変更可）
+WEBGL_POINT_THRESHOLD = int(os.environ.get("SIMPLECHAT_WEBGL_POINTS", 10000))
+
+# SVGのトレース型と、対応するWebGLのトレース
+WEBGL_TRACES = {
+    "scatter": go.Scattergl,
+    "scatterpolar": go.Scatterpolargl,
+}
+
+
+def use_webgl(n_points, threshold=None):
+    threshold = WEBGL_POINT_THRESHOLD if threshold is None else threshold
+    return n_points > threshold
+
+
+def count_points(fig):
+    total = 0
+    for trace in fig.data:
+        values = trace.x if getattr(trace, "x", None) is not None else getattr(trace, "y", None)
+        if values is None:
+            values = getattr(trace, "r", None)
+        if values is not None:
+            total += len(values)
+    return total
+
+
+def _to_webgl(trace):
+    webgl_trace = WEBGL_TRACES.get(trace.type)
+    if webgl_trace is None:
+        return trace
+    props = trace.to_plotly_json()
+    props.pop("type")
+    # cliponaxis など WebGL側にない属性は捨てる
+    return webgl_trace(props, skip_invalid=True)
+
+
+def webgl(fig, threshold=None):
+    # 閾値以下、または置き換える対象がなければ元の図をそのまま返す
+    if not use_webgl(count_points(fig), threshold):
+        return fig
+    if not any(trace.type in WEBGL_TRACES for trace in fig.data):
+        return fig
+    # アニメーションのフレームも同じ型にそろえないと再生時に描画が崩れる
+    frames = [go.Frame(frame.to_plotly_json() | {"data": [_to_webgl(t) for t in frame.data]})
+              for frame in fig.frames]
+    return go.Figure(data=[_to_webgl(t) for t in fig.data], layout=fig.layout, frames=frames)
@@ -0,0 +1,166 @@
+# 表全体の統計量をまとめて計算する処理
+# 列の選択が変わるたびに計算し直さず、全列分を一度計算して選択した列を取り出して使う
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# 行をこの件数ずつに分けて計算する（メモリに載せる作業配列の大きさを抑える）
+BLOCK_ROWS = 65536
+# 順位付けは列をこの本数ずつに分けて行う（作業配列は 行数 x 本数 の大きさになる）
+BLOCK_COLUMNS = 16
+
+
+def _blocks(n, size):
+    for start in range(0, n, size):
+        yield slice(start, min(start + size, n))
+
+
+def pearson_matrix(values, dtype=np.float32, block_rows=BLOCK_ROWS):
+    # 1回目で列の平均、2回目で中心化した値の積和を行のブロックごとに求めて足し合わせる
+    # ブロック内の積は dtype（既定は float32）で計算し、ブロック間の合計は float64 で行う
+    # 欠損値（NaN）があれば、列の組ごとに両方の値がある行だけを使う（DataFrame.corr() と同じ）
+    # 戻り値は 相関係数の行列 と 各組で使った行数（欠損値がなければ行数そのもの）
+    n, k = values.shape
+    total = np.zeros(k)
+    valid_count = np.zeros(k)
+    for rows in _blocks(n, block_rows):
+        block = values[rows]
+        total += np.nansum(block, axis=0, dtype=np.float64)
+        valid_count += (~np.isnan(block)).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / valid_count
+    if (valid_count == n).all():
+        cross = np.zeros((k, k))
+        for rows in _blocks(n, block_rows):
+            block = (values[rows] - mean).astype(dtype, copy=False)
+            cross += block.T @ block
+        scale = np.sqrt(np.diag(cross))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            r = cross / np.outer(scale, scale)
+        return np.clip(r, -1, 1), n
+
+    # count[i, j]: 両方の値がある行数、sums[i, j] と squares[i, j]: 列 j の値がある行での列 i の和と二乗和
+    count = np.zeros((k, k))
+    sums = np.zeros((k, k))
+    squares = np.zeros((k, k))
+    cross = np.zeros((k, k))
+    for rows in _blocks(n, block_rows):
+        block = (values[rows] - mean).astype(dtype, copy=False)
+        valid = ~np.isnan(block)
+        block = np.where(valid, block, 0).astype(dtype, copy=False)
+        valid = valid.astype(dtype)
+        count += valid.T @ valid
+        sums += block.T @ valid
+        squares += (block * block).T @ valid
+        cross += block.T @ block
+    with np.errstate(invalid="ignore", divide="ignore"):
+        covariance = cross - sums * sums.T / count
+        variance = squares - sums ** 2 / count
+        r = covariance / np.sqrt(variance * variance.T)
+    return np.clip(r, -1, 1), count
+
+
+def _average_ranks(block):
+    # block は (列, 行) の配列。行方向に並べ替え、同じ値が続く区間には区間の平均順位を付ける
+    k, n = block.shape
+    order = np.argsort(block, axis=1)
+    ordered = np.take_along_axis(block, order, axis=1)
+    starts_run = np.ones((k, n), dtype=bool)
+    starts_run[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    flat = starts_run.ravel()
+    starts = np.flatnonzero(flat)
+    lengths = np.diff(np.r_[starts, flat.size])
+    average = starts % n + (lengths + 1) / 2
+    ranks = np.empty((k, n))
+    np.put_along_axis(ranks, order, average[np.cumsum(flat) - 1].reshape(k, n), axis=1)
+    return ranks
+
+
+def rank_columns(values, dtype=np.float32, block_columns=BLOCK_COLUMNS):
+    # 列ごとの順位（同順位は平均順位）。列のブロックごとに転置して連続したメモリ上でまとめて順位を付ける
+    ranks = np.empty(values.shape, dtype=dtype)
+    for cols in _blocks(values.shape[1], block_columns):
+        ranks[:, cols] = _average_ranks(np.ascontiguousarray(values[:, cols].T)).T
+    return ranks
+
+
+def p_values(r, n):
+    # 無相関の検定（t = r * sqrt((n-2) / (1-r^2))、自由度 n-2）の両側p値。n は列の組ごとの行数の行列でもよい
+    df = n - 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = r * np.sqrt(df / (1 - r ** 2))
+        p = 2 * stats.t.sf(np.abs(t), df)
+    np.fill_diagonal(p, 0)
+    return p
+
+
+def _missing_patterns(values):
+    # 欠損値の位置が同じ列をまとめる（欠損値がなければ全列で1つ）
+    patterns = {}
+    for j in range(values.shape[1]):
+        valid = ~np.isnan(values[:, j])
+        patterns.setdefault(np.packbits(valid).tobytes(), (valid, []))[1].append(j)
+    return [(valid, np.array(cols)) for valid, cols in patterns.values()]
+
+
+def spearman_matrix(values, dtype=np.float32):
+    # 順位を付けてから Pearson の相関係数を求める
+    # 欠損値があれば DataFrame.corr(method="spearman") と同じく、列の組ごとに両方の値がある行だけで順位を付け直す
+    # 欠損値の位置が同じ列はまとめて順位を付けるので、順位付けの回数は（欠損値の位置の種類）の2乗程度で済む
+    k = values.shape[1]
+    groups = _missing_patterns(values)
+    r = np.full((k, k), np.nan)
+    count = np.zeros((k, k))
+    for a, (valid_a, cols_a) in enumerate(groups):
+        for valid_b, cols_b in groups[a:]:
+            rows = valid_a & valid_b
+            cols = np.unique(np.r_[cols_a, cols_b])
+            subset = values if rows.all() and len(cols) == k else values[np.ix_(rows, cols)]
+            block, _ = pearson_matrix(rank_columns(subset, dtype), dtype)
+            a_pos, b_pos = np.searchsorted(cols, cols_a), np.searchsorted(cols, cols_b)
+            r[np.ix_(cols_a, cols_b)] = block[np.ix_(a_pos, b_pos)]
+            r[np.ix_(cols_b, cols_a)] = block[np.ix_(b_pos, a_pos)]
+            count[np.ix_(cols_a, cols_b)] = count[np.ix_(cols_b, cols_a)] = rows.sum()
+    return r, (count if len(groups) > 1 else len(values))
+
+
+def correlations(df, dtype=np.float32):
+    # 数値の列すべてについて Pearson と Spearman の相関係数とp値を計算する
+    # 欠損値は列の組ごとに除く（DataFrame.corr() と同じ）。p値もその組で使った行数で求める
+    # 値は float64 のまま渡し、dtype は中心化したブロックと順位にだけ使う（大きな定数が乗った列でも桁落ちしない）
+    numeric = df.select_dtypes("number")
+    values = numeric.to_numpy(dtype=np.float64)
+    columns = numeric.columns
+    result = {}
+    for method, matrix in (("pearson", pearson_matrix), ("spearman", spearman_matrix)):
+        r, n = matrix(values, dtype)
+        result[method] = (pd.DataFrame(r, index=columns, columns=columns),
+                          pd.DataFrame(p_values(r, n), index=columns, columns=columns))
+    return result
+
+
+def box_stats(df):
+    # 列ごとの四分位数（線形補間）・ひげの端（四分位範囲の1.5倍以内にある最小・最大）・外れ値（重複は除く）
+    # 箱ひげ図をこの値だけで描けば、送るデータの大きさは行数によらない
+    numeric = df.select_dtypes("number")
+    values = numeric.to_numpy(dtype=np.float64)
+    q1, median, q3 = np.nanpercentile(values, [25, 50, 75], axis=0)
+    low = q1 - 1.5 * (q3 - q1)
+    high = q3 + 1.5 * (q3 - q1)
+    inside = (values >= low) & (values <= high)
+    summary = pd.DataFrame({
+        "q1": q1, "median": median, "q3": q3,
+        "lowerfence": np.where(inside, values, np.inf).min(axis=0),
+        "upperfence": np.where(inside, values, -np.inf).max(axis=0),
+    }, index=numeric.columns)
+    outliers = {col: np.unique(values[~inside[:, i] & ~np.isnan(values[:, i]), i])
+                for i, col in enumerate(numeric.columns)}
+    return summary, outliers
+
+
+def histograms(df, bins=10):
+    # 列ごとの度数と階級の境界（np.histogram）
+    result = {}
+    for col, series in df.select_dtypes("number").items():
+        result[col] = np.histogram(series.dropna().to_numpy(dtype=np.float64), bins=bins)
+    return result
@@ -0,0 +1,166 @@
+# Googleトレンドの取得層
+# 結果は (キーワード, 期間, 地域) ごとにディスクにキャッシュし、古くなったら古い結果を返しつつ裏で取り直す
+# 取得元は共有の pytrends クライアント（リクエストの間隔を空ける）か、ネットワークに出ないスタブ
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from datasource import CACHE_DIR, OFFLINE, interest_over_time, write_atomic
+
+TRENDS_DIR = CACHE_DIR / "trends"
+
+# キャッシュを取り直すまでの秒数
+TRENDS_TTL = float(os.environ.get("SIMPLECHAT_TRENDS_TTL", 24 * 3600))
+
+# Googleトレンドへのリクエストの最小間隔（秒）
+MIN_INTERVAL = float(os.environ.get("SIMPLECHAT_TRENDS_INTERVAL", 10))
+
+# 1回のリクエストに含められるキーワードの数（Googleトレンドの上限）
+MAX_KEYWORDS = 5
+
+# pytrends のクライアントの言語とタイムゾーン
+HL = "ja-JP"
+TZ = 360
+
+_client = None
+_client_lock = threading.Lock()
+_last_request = 0.0
+
+_refreshing = set()
+_refresh_lock = threading.Lock()
+
+
+def pytrends_query(kw_list, timeframe, geo):
+    # クライアントはプロセスで1つだけ作って使い回し、リクエストは前回から MIN_INTERVAL 秒以上空けて1つずつ送る
+    global _client, _last_request
+    with _client_lock:
+        if _client is None:
+            from pytrends.request import TrendReq
+            _client = TrendReq(hl=HL, tz=TZ)
+        wait = _last_request + MIN_INTERVAL - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        try:
+            _client.build_payload(kw_list, timeframe=timeframe, geo=geo)
+            return _client.interest_over_time()
+        finally:
+            _last_request = time.monotonic()
+
+
+def _date_range(timeframe):
+    # "2020-01-01 2024-08-05" の形式以外（"today 5-y" など）は直近5年として扱う
+    try:
+        start, end = (pd.Timestamp(part) for part in timeframe.split())
+    except ValueError:
+        end = pd.Timestamp.today().normalize()
+        start = end - pd.DateOffset(years=5)
+    return start, end
+
+
+def stub_query(kw_list, timeframe, geo):
+    # ネットワークに出ずに、キーワードと地域から決まる値の系列を返す（テストやオフラインでの確認用）
+    # Googleトレンドと同じく、期間の長さで日・週・月ごとの値にし、リクエスト内の最大値を100にそろえる
+    start, end = _date_range(timeframe)
+    days = (end - start).days
+    freq = "D" if days < 270 else "W-SUN" if days < 5 * 366 else "MS"
+    dates = pd.date_range(start, end, freq=freq, name="date")
+    t = np.arange(len(dates))
+    columns = {}
+    for kw in kw_list:
+        seed = int(hashlib.sha1(f"{kw}|{geo}".encode("utf-8")).hexdigest()[:8], 16)
+        rng = np.random.default_rng(seed)
+        level, amplitude, period = rng.uniform(10, 60), rng.uniform(0, 30), rng.uniform(10, 60)
+        columns[kw] = level + amplitude * np.sin(2 * np.pi * t / period) + rng.normal(0, 3, len(t)).cumsum()
+    df = pd.DataFrame(columns, index=dates).clip(lower=0)
+    peak = df.to_numpy().max()
+    df = (df / (peak if peak > 0 else 1) * 100).round().astype(int)
+    df["isPartial"] = False
+    return df
+
+
+BACKENDS = {
+    "pytrends": pytrends_query,
+    "stub": stub_query,
+}
+
+# SIMPLECHAT_TRENDS_BACKEND=stub でスタブを使う
+BACKEND = os.environ.get("SIMPLECHAT_TRENDS_BACKEND", "pytrends")
+
+
+def batched_query(kw_list, timeframe, geo, query):
+    # キーワードを MAX_KEYWORDS 個ずつのリクエストに分ける
+    # 値はリクエストごとに相対値なので、2回目以降は先頭のキーワードを共通に含め、その合計が1回目と同じになるように換算する
+    kw_list = list(kw_list)
+    first = query(kw_list[:MAX_KEYWORDS], timeframe, geo)
+    if len(kw_list) <= MAX_KEYWORDS:
+        return first
+    anchor = kw_list[0]
+    frames = [first[kw_list[:MAX_KEYWORDS]]]
+    for start in range(MAX_KEYWORDS, len(kw_list), MAX_KEYWORDS - 1):
+        batch = [anchor] + kw_list[start:start + MAX_KEYWORDS - 1]
+        df = query(batch, timeframe, geo)
+        total = df[anchor].sum()
+        frames.append(df[batch[1:]] * (first[anchor].sum() / total if total else 1.0))
+    result = pd.concat(frames, axis=1)
+    if "isPartial" in first:
+        result["isPartial"] = first["isPartial"]
+    return result
+
+
+def _cache_path(kw_list, timeframe, geo):
+    key = json.dumps([list(kw_list), timeframe, geo], ensure_ascii=False)
+    return TRENDS_DIR / (hashlib.sha1(key.encode("utf-8")).hexdigest() + ".parquet")
+
+
+def _fetch(kw_list, timeframe, geo):
+    # ミラーのCSVがあればそれを、なければ取得元に問い合わせた結果をキャッシュに保存する
+    query = BACKENDS[BACKEND]
+    df = interest_over_time(list(kw_list), timeframe, geo,
+                            lambda kw_list, timeframe, geo: batched_query(kw_list, timeframe, geo, query))
+    write_atomic(_cache_path(kw_list, timeframe, geo), df.to_parquet)
+    return df
+
+
+def _refresh(kw_list, timeframe, geo):
+    try:
+        _fetch(kw_list, timeframe, geo)
+    except Exception as e:
+        # 取り直しに失敗しても古いキャッシュはそのまま使い続ける
+        print(f"{list(kw_list)} {timeframe} {geo}: {e}", file=sys.stderr)
+    finally:
+        with _refresh_lock:
+            _refreshing.discard((kw_list, timeframe, geo))
+
+
+def refresh_in_background(kw_list, timeframe, geo):
+    # 同じ条件の取り直しが実行中なら何もしない。スレッドを起動したら True
+    key = (tuple(kw_list), timeframe, geo)
+    with _refresh_lock:
+        if key in _refreshing:
+            return False
+        _refreshing.add(key)
+    threading.Thread(target=_refresh, args=key, daemon=True).start()
+    return True
+
+
+def is_refreshing(kw_list, timeframe, geo):
+    with _refresh_lock:
+        return (tuple(kw_list), timeframe, geo) in _refreshing
+
+
+def get_interest(kw_list, timeframe, geo="JP", ttl=TRENDS_TTL):
+    # キャッシュがあればすぐに返し、ttl 秒より古ければ裏で取り直す（次に呼ばれたときに新しい結果になる）
+    # キャッシュがないときだけ、その場で取得するのを待つ
+    path = _cache_path(kw_list, timeframe, geo)
+    if path.exists():
+        df = pd.read_parquet(path)
+        if not OFFLINE and time.time() - path.stat().st_mtime >= ttl:
+            refresh_in_background(kw_list, timeframe, geo)
+        return df
+    return _fetch(kw_list, timeframe, geo)